@@ -0,0 +1,330 @@
+# ============================================
+# Filename: bench_planner.py
+# Purpose: Offline benchmarks for the planner hot paths
+# Replays recorded SerpAPI payloads and a fake Calendar service (no network)
+#
+# Usage:
+#   python bench_planner.py                       # all cases, default scales
+#   python bench_planner.py --scales 10,1000 --only extract_flights,filter
+#   python bench_planner.py --sessions 50 --reruns 20 --latency 0.08   # load test
+# ============================================
+
+import argparse
+import copy
+import glob
+import itertools
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+os.chdir(HERE)  # planner reads travel_calendar_id.txt relative to cwd
+os.environ.setdefault("SERPAPI_KEY", "offline-bench")
+
+import itinerary
+import metrics
+import planner
+import ranking
+from fake_calendar import FakeCalendarService
+
+DEFAULT_SCALES = [10, 100, 1000, 10000, 100000]
+FIXTURE_GLOBS = ["flights_*.json", os.path.join("old", "flights_cache.json")]
+
+
+# -----------------------------------------------------
+# FIXTURES
+# -----------------------------------------------------
+def load_fixture_payloads():
+    """Every recorded SerpAPI response on disk, in the raw one-way shape."""
+    payloads = []
+    for pattern in FIXTURE_GLOBS:
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as f:
+                data = json.load(f)
+            if "outbound_raw" in data:
+                payloads.extend([data["outbound_raw"], data["inbound_raw"]])
+            else:
+                payloads.append(data)
+    return payloads
+
+
+def _shift(s, minutes):
+    dt = datetime.strptime(s, "%Y-%m-%d %H:%M") + timedelta(minutes=minutes)
+    return dt.strftime("%Y-%m-%d %H:%M")
+
+
+def synth_payload(templates, n):
+    """Scale recorded blocks up to n itineraries by cycling them with shifted times.
+
+    Each copy also gets its own flight numbers, so all n are distinct
+    itineraries (itinerary_key is flight numbers + times).
+    """
+    blocks = []
+    for i in range(n):
+        block = copy.deepcopy(templates[i % len(templates)])
+        round_ = i // len(templates)
+        # Spread copies over +-3h so filters see a realistic mix of pass/fail.
+        shift = (round_ % 37 - 18) * 10
+        for seg in block.get("flights", []):
+            seg["departure_airport"]["time"] = _shift(seg["departure_airport"]["time"], shift)
+            seg["arrival_airport"]["time"] = _shift(seg["arrival_airport"]["time"], shift)
+            if round_:
+                seg["flight_number"] = f"{seg.get('flight_number') or seg.get('airline', '?')}-{round_}"
+        if block.get("price") is not None:
+            block["price"] += i % 97
+        blocks.append(block)
+    cut = max(1, n // 5)
+    return {"best_flights": blocks[:cut], "other_flights": blocks[cut:]}
+
+
+def activity_events(day, count, first_hour, last_hour, preview=False):
+    """count one-hour activities spread over first_hour-last_hour on day (a date),
+    plus optionally one old preview the constraints must skip."""
+    events = []
+    span = (last_hour - first_hour - 1) * 60
+    for i in range(count):
+        start = planner.TZ.localize(datetime(day.year, day.month, day.day, first_hour)
+                                    + timedelta(minutes=(i * 17) % span))
+        events.append({
+            "summary": f"Activity {i}",
+            "start": {"dateTime": start.isoformat()},
+            "end": {"dateTime": (start + timedelta(hours=1)).isoformat()},
+        })
+    if preview:
+        events.append({
+            "summary": "old preview",
+            "start": {"dateTime": planner.TZ.localize(datetime(day.year, day.month, day.day, 6)).isoformat()},
+            "end": {"dateTime": planner.TZ.localize(datetime(day.year, day.month, day.day, 7)).isoformat()},
+            "extendedProperties": {"private": {"flight_preview": "outbound"}},
+        })
+    return events
+
+
+# -----------------------------------------------------
+# CASES
+# -----------------------------------------------------
+# Each case takes (ctx, n) and returns a zero-arg callable to time.
+# ctx holds the synthetic payload/itineraries for the current scale.
+
+def case_extract_flights(ctx, n):
+    raw = ctx["raw"]
+    return lambda: planner.extract_flights(raw)
+
+
+def case_dedup(ctx, n):
+    # Two overlapping searches: the full set plus its first half again.
+    flights = ctx["flights"]
+    overlap = flights[: n // 2]
+    return lambda: planner.dedup_flights(flights, overlap)
+
+
+def case_filter(ctx, n):
+    flights = ctx["flights"]
+    day = planner.parse_dt(flights[0]["segments"][-1]["arr_time"]).date()
+    cutoff = planner.TZ.localize(datetime(day.year, day.month, day.day, 18))
+
+    def run():
+        planner.filter_arrival_flights(flights, cutoff)
+        planner.filter_departure_flights(flights, cutoff)
+
+    return run
+
+
+def case_rank(ctx, n):
+    flights = ctx["flights"]
+    slack = [(i * 7) % 300 for i in range(n)]
+    return lambda: ranking.rank(flights, slack)
+
+
+def case_pairing(ctx, n):
+    # planner pairs legs by filtering each against its day's constraints and
+    # picking the current index on each side; time that whole selection step.
+    svc = ctx["calendar"]
+
+    def run():
+        earliest, _ = planner.get_day_constraints(svc, ctx["out_day"])
+        _, latest = planner.get_day_constraints(svc, ctx["in_day"])
+        out = planner.filter_arrival_flights(ctx["outbound"], earliest)
+        inb = planner.filter_departure_flights(ctx["inbound"], latest)
+        return (out[7 % len(out)] if out else None), (inb[7 % len(inb)] if inb else None)
+
+    return run
+
+
+def case_preview_sync(ctx, n):
+    svc = ctx["calendar"]
+    # Alternate two picks so every run has segments to swap.
+    picks = itertools.cycle([planner.preview_bodies(f, "outbound", "9") for f in ctx["flights"][:2]])
+    return lambda: planner.sync_preview(svc, "outbound", next(picks))
+
+
+CASES = {
+    "extract_flights": case_extract_flights,
+    "dedup": case_dedup,
+    "filter": case_filter,
+    "rank": case_rank,
+    "pairing": case_pairing,
+    "preview_sync": case_preview_sync,
+}
+
+
+# -----------------------------------------------------
+# RUNNER
+# -----------------------------------------------------
+def build_context(templates, n):
+    raw = synth_payload(templates, n)
+    flights = planner.extract_flights(raw)
+    # The recorded payloads mix routes; the first one's is the outbound, its
+    # reverse the inbound.
+    first = flights[0]["segments"]
+    outbound = [f for f in flights if f["segments"][0]["dep"] == first[0]["dep"]
+                and f["segments"][-1]["arr"] == first[-1]["arr"]]
+    inbound = [f for f in flights if f["segments"][0]["dep"] == first[-1]["arr"]
+               and f["segments"][-1]["arr"] == first[0]["dep"]] or flights
+    out_day = planner.parse_dt(outbound[0]["segments"][-1]["arr_time"]).date()
+    in_day = planner.parse_dt(inbound[0]["segments"][0]["dep_time"]).date()
+
+    # Afternoon activities on arrival and morning ones before flying home, so
+    # the earlier arrivals and later departures fit, as on a real trip.
+    svc = FakeCalendarService(tz=planner.TZ)
+    svc.seed(planner.TRAVEL_CAL_ID, activity_events(out_day, 20, 14, 20, preview=True)
+             + activity_events(in_day, 20, 7, 12))
+    planner.EVENTS.reset()  # the event mirror belongs to the previous fake calendar
+    return {"raw": raw, "flights": flights, "outbound": outbound, "inbound": inbound,
+            "out_day": out_day, "in_day": in_day, "calendar": svc}
+
+
+def time_case(fn, repeat):
+    best = None
+    calls = {}
+    for _ in range(repeat):
+        metrics.begin_run()
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+        calls = metrics.run_snapshot()["counters"]
+    return best, calls
+
+
+def load_templates():
+    templates = []
+    for payload in load_fixture_payloads():
+        templates.extend(payload.get("best_flights", []) + payload.get("other_flights", []))
+    if not templates:
+        sys.exit("No recorded SerpAPI fixtures found.")
+    return templates
+
+
+def run(scales, only, repeat):
+    templates = load_templates()
+    results = []
+    print(f"{'case':<18}{'n':>8}{'best ms':>12}{'us/item':>10}  api calls")
+    for n in scales:
+        ctx = build_context(templates, n)
+        for name, make in CASES.items():
+            if only and name not in only:
+                continue
+            best, calls = time_case(make(ctx, n), repeat)
+            per_item = best / n * 1e6
+            print(f"{name:<18}{n:>8}{best * 1000:>12.3f}{per_item:>10.3f}  {calls or ''}")
+            results.append({"case": name, "n": n, "best_s": best, "api_calls": calls})
+    return results
+
+
+# -----------------------------------------------------
+# LOAD TEST
+# -----------------------------------------------------
+def planner_rerun(svc, state, rules, weights, tag):
+    """One Streamlit rerun without the UI: plan_options, then the writer's preview sync."""
+    valid_out, _, _, _ = planner.plan_options(svc, state, rules, weights)
+    if valid_out:
+        planner.sync_preview(svc, tag, planner.preview_bodies(valid_out[state["idx_out"]], tag, "9"))
+    state["idx_out"] += 1  # the next rerun previews the next option, like clicking ➡️
+    return len(valid_out)
+
+
+def calendar_calls():
+    return sum(v for k, v in metrics.totals_snapshot()["counters"].items() if k.startswith("calendar_calls"))
+
+
+def load_test(templates, sessions, reruns, latency, jitter, n):
+    if planner.ROUND_TRIP or planner.MULTI_CITY:
+        sys.exit("The load test drives the one-way planner; unset PLANNER_TRIP_MODE.")
+    ctx = build_context(templates, n)
+    svc = ctx["calendar"]
+    svc.latency, svc.jitter = latency, jitter
+    rules = itinerary.connection_rules(
+        planner.MIN_CONNECTION, planner.AIRPORT_MIN_CONNECTION, planner.MAX_LAYOVER_HOURS * 60 or None
+    )
+    weights = ranking.PRESETS["balanced"]
+
+    samples = []
+    options = []
+    lock = threading.Lock()
+
+    def session(i):
+        state = {"idx_out": 0, "idx_in": 0}
+        planner.store_flights(state, (ctx["outbound"], ctx["inbound"]), {f"bench_{n}": 0.0})
+        mine, shown = [], []
+        for _ in range(reruns):
+            t0 = time.perf_counter()
+            shown.append(planner_rerun(svc, state, rules, weights, f"outbound-{i}"))
+            mine.append(time.perf_counter() - t0)
+        with lock:
+            samples.extend(mine)
+            options.extend(shown)
+
+    calls_before = calendar_calls()
+    threads = [threading.Thread(target=session, args=(i,)) for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    samples.sort()
+    q = statistics.quantiles(samples, n=100) if len(samples) > 1 else samples * 99
+    print(f"{sessions} sessions x {reruns} reruns, {n} itineraries, "
+          f"{latency * 1000:.0f}ms (+{jitter * 1000:.0f}ms) per Calendar call")
+    print(f"  options  {statistics.mean(options):10.1f} outbound per rerun")
+    print(f"  calls    {(calendar_calls() - calls_before) / len(samples):10.2f} Calendar calls per rerun")
+    print(f"  reruns/s {len(samples) / wall:10.1f}")
+    print(f"  p50 ms   {q[49] * 1000:10.1f}")
+    print(f"  p95 ms   {q[94] * 1000:10.1f}")
+    print(f"  p99 ms   {q[98] * 1000:10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline planner benchmarks")
+    parser.add_argument("--scales", default=",".join(map(str, DEFAULT_SCALES)))
+    parser.add_argument("--only", default="", help="comma-separated case names")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", help="also write results to this file")
+    parser.add_argument("--sessions", type=int, default=0, help="run a concurrent load test instead")
+    parser.add_argument("--reruns", type=int, default=10)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per fake Calendar call")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--itineraries", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.sessions:
+        load_test(load_templates(), args.sessions, args.reruns, args.latency, args.jitter, args.itineraries)
+        return
+
+    scales = [int(s) for s in args.scales.split(",") if s]
+    only = {s for s in args.only.split(",") if s}
+    results = run(scales, only, args.repeat)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+# ============================================
+# Filename: calendar_constraints.py
+# Purpose: Local mirror of the travel calendar for day-constraint lookups
+# Events are synced once (recurring events as their master + RRULE, not as
+# server-expanded instances) and then kept current with incremental sync
+# tokens. Recurrences are expanded here, so any day can be answered without
+# listing again. All-day events count according to a configurable mode.
+# ============================================
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pytz
+from dateutil.rrule import rrulestr
+from googleapiclient.errors import HttpError
+
+import calendar_list
+
+# How all-day events constrain a day:
+#   ignore  - they don't (the planner's original behaviour)
+#   workday - busy during working hours (all_day_hours) on each day they cover
+#   block   - busy for the whole day
+ALL_DAY_MODES = ("ignore", "workday", "block")
+
+# Everything the expansion and the what-if picker read; the rest of each
+# event is never downloaded.
+EVENT_FIELDS = ("id,status,updated,summary,start,end,recurrence,recurringEventId,"
+                "originalStartTime,extendedProperties/private")
+
+# Events the planner writes itself never constrain the trip.
+OWN_EVENT_PROPS = ("flight_preview", "trip_block", "booked_flight")
+
+
+def _is_own(ev):
+    private = ev.get("extendedProperties", {}).get("private", {})
+    return any(p in private for p in OWN_EVENT_PROPS)
+
+
+class EventCache:
+    """Synced copy of one calendar's events, with expanded recurrences cached per day.
+
+    sync() costs one (usually empty) incremental list call, and at most one per
+    refresh_interval seconds; day_bounds() never touches the network.
+    """
+
+    def __init__(self, calendar_id, tz, refresh_interval=1.0):
+        self.calendar_id = calendar_id
+        self.tz = tz
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._events = {}        # id -> event (masters, one-offs and moved instances)
+            self._sync_token = None
+            self._synced_at = 0.0
+            self._rules = {}         # (id, updated) -> compiled rruleset
+            self._days = {}          # (date, mode, hours) -> (earliest start, latest end)
+
+    # ---------- sync ----------
+    def sync(self, service):
+        with self._lock:
+            if time.time() - self._synced_at < self.refresh_interval:
+                return
+            try:
+                changed = self._pull(service, self._sync_token)
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                # Token expired: start over with a full sync.
+                self._events.clear()
+                self._rules.clear()
+                changed = self._pull(service, None)
+            if changed:
+                self._days.clear()
+            self._synced_at = time.time()
+
+    def _pull(self, service, token):
+        changed = False
+        result = {}
+        params = {"syncToken": token} if token else {}
+        for ev in calendar_list.list_events(service, self.calendar_id, fields=EVENT_FIELDS,
+                                            result=result, showDeleted=True, **params):
+            changed = True
+            if ev.get("status") == "cancelled" and "recurringEventId" not in ev:
+                self._events.pop(ev["id"], None)
+            else:
+                self._events[ev["id"]] = ev
+        self._sync_token = result["nextSyncToken"]
+        return changed
+
+    # ---------- expansion ----------
+    def _zone(self, ev):
+        return pytz.timezone(ev["start"]["timeZone"]) if "timeZone" in ev["start"] else self.tz
+
+    @staticmethod
+    def _wall(value, zone):
+        """Start/end dict -> naive wall-clock datetime on `zone`'s clock."""
+        if "dateTime" in value:
+            return datetime.fromisoformat(value["dateTime"]).astimezone(zone).replace(tzinfo=None)
+        return datetime.strptime(value["date"], "%Y-%m-%d")
+
+    def _ruleset(self, ev, zone):
+        key = (ev["id"], ev.get("updated"))
+        rules = self._rules.get(key)
+        if rules is None:
+            # Expanded on the event's own wall clock so DST changes don't shift it.
+            rules = self._rules[key] = rrulestr(
+                "\n".join(ev["recurrence"]), dtstart=self._wall(ev["start"], zone),
+                forceset=True, ignoretz=True,
+            )
+        return rules
+
+    def _instances(self, day, events):
+        """(start, end, all_day) for every foreign event overlapping `day`.
+
+        Timed values are tz-aware datetimes; all-day values are dates.
+        """
+        lo = datetime(day.year, day.month, day.day)
+        hi = lo + timedelta(days=1)
+
+        # Instances that were moved or cancelled; their exception events stand in.
+        overridden = {}
+        for ev in events.values():
+            if "recurringEventId" in ev and "originalStartTime" in ev:
+                overridden.setdefault(ev["recurringEventId"], []).append(ev["originalStartTime"])
+
+        spans = []
+        for ev in events.values():
+            if _is_own(ev) or ev.get("status") == "cancelled":
+                continue
+            all_day = "date" in ev["start"]
+            zone = self._zone(ev)
+            start, end = self._wall(ev["start"], zone), self._wall(ev["end"], zone)
+            if not ev.get("recurrence"):
+                spans.append((start, end, all_day, zone))
+                continue
+
+            length = end - start
+            skip = {self._wall(v, zone) for v in overridden.get(ev["id"], [])}
+            # A day of padding either side covers zones other than ours.
+            for occ in self._ruleset(ev, zone).between(lo - length - timedelta(days=1),
+                                                        hi + timedelta(days=1), inc=True):
+                if occ not in skip:
+                    spans.append((occ, occ + length, all_day, zone))
+
+        day_start, day_end = self.tz.localize(lo), self.tz.localize(hi)
+        out = []
+        for start, end, all_day, zone in spans:
+            if all_day:
+                if start.date() <= day < end.date():
+                    out.append((start.date(), end.date(), True))
+            else:
+                start, end = zone.localize(start), zone.localize(end)
+                if start < day_end and end > day_start:
+                    out.append((start, end, False))
+        return out
+
+    # ---------- queries ----------
+    def day_bounds(self, day, all_day="ignore", all_day_hours=(9, 17), overlay=None):
+        """(earliest activity start, latest activity end) on `day`, tz-aware, or None.
+
+        overlay ({event id: event}) replaces or adds events for a what-if
+        evaluation; it is never cached or sent anywhere.
+        """
+        key = (day, all_day, all_day_hours)
+        with self._lock:
+            if not overlay:
+                cached = self._days.get(key)
+                if cached is not None:
+                    return cached
+            events = {**self._events, **overlay} if overlay else self._events
+
+            starts, ends = [], []
+            at = lambda hour, minute=0: self.tz.localize(datetime(day.year, day.month, day.day, hour, minute))
+            for start, end, is_all_day in self._instances(day, events):
+                if not is_all_day:
+                    starts.append(start)
+                    ends.append(end)
+                elif all_day == "workday":
+                    starts.append(at(all_day_hours[0]))
+                    ends.append(at(all_day_hours[1]))
+                elif all_day == "block":
+                    starts.append(at(0))
+                    ends.append(at(23, 59))
+
+            bounds = (min(starts) if starts else None), (max(ends) if ends else None)
+            if not overlay:
+                self._days[key] = bounds
+            return bounds
+
+    def movable(self, day):
+        """Foreign one-off timed events overlapping `day` (what-if move candidates)."""
+        day_start = self.tz.localize(datetime(day.year, day.month, day.day))
+        day_end = day_start + timedelta(days=1)
+        with self._lock:
+            return sorted(
+                (ev for ev in self._events.values()
+                 if not _is_own(ev) and ev.get("status") != "cancelled" and not ev.get("recurrence")
+                 and "dateTime" in ev["start"]
+                 and datetime.fromisoformat(ev["start"]["dateTime"]) < day_end
+                 and datetime.fromisoformat(ev["end"]["dateTime"]) > day_start),
+                key=lambda ev: datetime.fromisoformat(ev["start"]["dateTime"]),
+            )
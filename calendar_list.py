@@ -0,0 +1,35 @@
+# ============================================
+# Filename: calendar_list.py
+# Purpose: The one way this project lists Calendar events
+# Follows nextPageToken (so busy calendars aren't silently cut off at the
+# first page) and asks only for the event fields the caller reads.
+# ============================================
+
+import metrics
+
+PAGE_SIZE = 2500  # the API maximum; fewer round trips for big calendars
+
+
+def list_events(service, calendar_id, fields=None, page_size=PAGE_SIZE, result=None, **params):
+    """Yield every event matching params, page by page.
+
+    fields: event fields to return, in partial-response syntax (e.g.
+    "id,start,end"); None returns full resources. If `result` is a dict, it
+    receives the last page's nextSyncToken, for callers doing incremental sync.
+    """
+    projection = None
+    if fields is not None:
+        projection = f"items({fields}),nextPageToken,nextSyncToken"
+
+    page = None
+    while True:
+        metrics.inc("calendar_calls", op="list")
+        resp = service.events().list(
+            calendarId=calendar_id, maxResults=page_size, pageToken=page, fields=projection, **params
+        ).execute()
+        yield from resp.get("items", [])
+        page = resp.get("nextPageToken")
+        if not page:
+            if result is not None:
+                result["nextSyncToken"] = resp.get("nextSyncToken")
+            return
@@ -0,0 +1,284 @@
+# ============================================
+# Filename: calendar_writer.py
+# Purpose: Background queue for every Google Calendar mutation
+# The UI enqueues a write and moves on. Writes to the same key coalesce
+# (only the latest is sent), failures are retried with backoff, and the
+# pending queue is journaled to disk so a restart picks it back up.
+#
+# Each process keeps its own journal (calendar_queue.<pid>-<start>.json) and holds a
+# lock on it while running, so the web app and the terminal planner can run
+# side by side. On start, a writer adopts only the journals of processes that
+# have exited.
+# ============================================
+
+import glob
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import fcntl
+except ImportError:  # Windows: one shared journal, so run one front end at a time
+    fcntl = None
+
+from googleapiclient.errors import HttpError
+
+import metrics
+
+QUEUE_FILE = "calendar_queue.json"   # shared journal without fcntl; older versions' journal
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 1.0   # doubled after every failed attempt
+PREPARED_LIMIT = 64
+RETRYABLE_STATUS = {403, 429, 500, 502, 503, 504}
+
+_cond = threading.Condition()
+_queue = OrderedDict()     # coalesce key -> job dict, oldest first
+_applied = {}              # coalesce key -> version last written successfully
+_running = {}              # coalesce key -> job the worker is executing right now
+_handlers = {}             # op name -> handler(service, payload)
+_owner = None              # lock file held open (and locked) for the life of the process
+_process_id = f"{os.getpid()}-{time.time_ns()}"  # unique even if a pid is reused
+_prepared = OrderedDict()  # (tag, flight key) -> event bodies, LRU
+_thread = None
+
+
+# -----------------------------------------------------
+# PREPARED EVENT BODIES
+# -----------------------------------------------------
+def prepared(tag, key, build):
+    """Event bodies for (tag, flight key), built once with build() and kept LRU."""
+    with _cond:
+        bodies = _prepared.get((tag, key))
+        if bodies is not None:
+            _prepared.move_to_end((tag, key))
+            return bodies
+    bodies = build()
+    with _cond:
+        _prepared[(tag, key)] = bodies
+        while len(_prepared) > PREPARED_LIMIT:
+            _prepared.popitem(last=False)
+    return bodies
+
+
+# -----------------------------------------------------
+# QUEUE
+# -----------------------------------------------------
+def register(op, handler):
+    with _cond:
+        _handlers[op] = handler
+
+
+def enqueue(key, op, payload, version=None):
+    """Queue op(payload) under a coalesce key; a newer write to the key replaces it.
+
+    With a version, the write is dropped if that version is already on the
+    calendar - unless a write to the key is running, which may replace it.
+    """
+    with _cond:
+        if version is not None and key not in _running and _applied.get(key) == version:
+            if _queue.pop(key, None) is not None:
+                _changed()
+            return
+        job = _queue.get(key)
+        if job is not None and version is not None and job["version"] == version:
+            return
+        if job is not None:
+            metrics.inc("calendar_writes_coalesced")
+        _queue[key] = {"op": op, "payload": payload, "version": version, "attempts": 0, "not_before": 0}
+        _changed()
+
+
+def show_preview(tag, key, bodies):
+    """Make preview `tag` show these events (written in the background)."""
+    enqueue(f"preview:{tag}", "sync_preview", {"tag": tag, "bodies": bodies}, version=key)
+
+
+def depth():
+    with _cond:
+        return len(_queue)
+
+
+def drain(timeout=None):
+    """Wait for the queue to empty (e.g. before exiting). False on timeout."""
+    deadline = None if timeout is None else time.time() + timeout
+    with _cond:
+        while _queue or _running:
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                return False
+            _cond.wait(remaining)
+    return True
+
+
+def _changed():
+    # Caller holds _cond.
+    metrics.set_gauge("calendar_queue_depth", len(_queue))
+    _save()
+    _cond.notify_all()
+
+
+def _journal():
+    if fcntl is None:
+        return QUEUE_FILE
+    base, ext = os.path.splitext(QUEUE_FILE)
+    return f"{base}.{_process_id}{ext}"
+
+
+def _lock_path(journal):
+    return os.path.splitext(journal)[0] + ".lock"
+
+
+def _own():
+    """Lock this process's journal for as long as it runs (its liveness marker)."""
+    global _owner
+    if fcntl is None or _owner is not None:
+        return
+    _owner = open(_lock_path(_journal()), "w")
+    fcntl.flock(_owner, fcntl.LOCK_EX)
+
+
+def _save():
+    _own()
+    path = _journal()
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump([[k, job] for k, job in _queue.items()], f)
+    os.replace(tmp, path)
+
+
+def _read(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def _orphaned(path):
+    """Journals nobody runs any more: a dead process's, or the old shared one."""
+    if path == QUEUE_FILE:
+        return True
+    with open(_lock_path(path), "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False  # its process is still running and writes it itself
+        fcntl.flock(f, fcntl.LOCK_UN)
+        return True
+
+
+def _adopt(jobs):
+    for key, job in jobs:
+        if key not in _queue:  # anything queued since start is newer
+            job["not_before"] = 0
+            _queue[key] = job
+
+
+def _load():
+    """Take over the pending writes of journals whose process has exited."""
+    if fcntl is None:
+        if os.path.exists(QUEUE_FILE):
+            _adopt(_read(QUEUE_FILE))
+        metrics.set_gauge("calendar_queue_depth", len(_queue))
+        return
+
+    base, ext = os.path.splitext(QUEUE_FILE)
+    own = _journal()
+    # One process adopts at a time, so a journal is never taken over twice.
+    with open(base + ".lock", "w") as guard:
+        fcntl.flock(guard, fcntl.LOCK_EX)
+        try:
+            pattern = re.compile(re.escape(base) + r"\.\d+-\d+" + re.escape(ext) + "$")
+            orphans = [p for p in glob.glob(f"{base}.*{ext}") if pattern.match(p) and p != own]
+            orphans = [p for p in orphans + [QUEUE_FILE] if os.path.exists(p) and _orphaned(p)]
+            for path in orphans:
+                _adopt(_read(path))
+            # Ours holds everything before theirs go away.
+            _save()
+            for path in orphans:
+                os.remove(path)
+                if path != QUEUE_FILE and os.path.exists(_lock_path(path)):
+                    os.remove(_lock_path(path))
+        finally:
+            fcntl.flock(guard, fcntl.LOCK_UN)
+    metrics.set_gauge("calendar_queue_depth", len(_queue))
+
+
+# -----------------------------------------------------
+# WORKER
+# -----------------------------------------------------
+def _retryable(error):
+    if isinstance(error, HttpError):
+        return error.resp.status in RETRYABLE_STATUS
+    return isinstance(error, (OSError, TimeoutError))
+
+
+def _next_job():
+    with _cond:
+        while True:
+            now = time.time()
+            wake = None
+            for key, job in _queue.items():
+                if job["op"] not in _handlers:
+                    continue
+                if job["not_before"] <= now:
+                    _running[key] = job
+                    return key, job
+                wake = job["not_before"] if wake is None else min(wake, job["not_before"])
+            _cond.wait(None if wake is None else wake - now)
+
+
+def _finish(key, job, error):
+    with _cond:
+        del _running[key]
+        if _queue.get(key) is not job:
+            # Superseded while it was running; the newer job stays queued. Its
+            # write still happened (or may have), so _applied must say so.
+            if error is None:
+                _applied[key] = job["version"]
+            else:
+                _applied.pop(key, None)
+            _changed()
+            return
+        if error is None:
+            _applied[key] = job["version"]
+            del _queue[key]
+        else:
+            job["attempts"] += 1
+            if job["attempts"] >= MAX_ATTEMPTS or not _retryable(error):
+                metrics.inc("calendar_writes_dropped", op=job["op"])
+                print(f"calendar write {key} dropped after {job['attempts']} attempt(s):", error)
+                _applied.pop(key, None)
+                del _queue[key]
+            else:
+                metrics.inc("calendar_write_retries", op=job["op"])
+                job["not_before"] = time.time() + BACKOFF_SECONDS * 2 ** (job["attempts"] - 1)
+        _changed()
+
+
+def start(make_service):
+    """Start the worker once per process, resuming any journaled writes.
+
+    make_service() builds the worker's own Calendar client (httplib2 objects
+    are not thread-safe). Register handlers before calling this.
+    """
+    global _thread
+    with _cond:
+        if _thread is not None:
+            return
+        _load()
+
+        def loop():
+            service = make_service()
+            while True:
+                key, job = _next_job()
+                error = None
+                try:
+                    with metrics.timed(f"calendar_write_{job['op']}"):
+                        _handlers[job["op"]](service, job["payload"])
+                except Exception as e:
+                    error = e
+                _finish(key, job, error)
+
+        _thread = threading.Thread(target=loop, name="calendar-writer", daemon=True)
+        _thread.start()
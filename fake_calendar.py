@@ -0,0 +1,384 @@
+# ============================================
+# Filename: fake_calendar.py
+# Purpose: In-memory stand-in for the googleapiclient Calendar resource
+# Used by the offline benchmarks and for load testing without a Google account
+#
+# Supports events().list (privateExtendedProperty, timeMin/timeMax,
+# singleEvents, orderBy, maxResults/pageToken, syncToken, fields), get, insert,
+# import_, patch, delete and new_batch_http_request(), with optional latency injection.
+# ============================================
+
+import copy
+import itertools
+import json
+import random
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+from dateutil.rrule import rrulestr
+from googleapiclient.errors import HttpError
+
+import calendar_list
+
+# Hard cap on instances expanded from one open-ended recurring event.
+MAX_INSTANCES = 1000
+
+
+def _http_error(status, message):
+    resp = httplib2.Response({"status": status, "reason": message})
+    return HttpError(resp, json.dumps({"error": {"code": status, "message": message}}).encode())
+
+
+def _parse_time(value, tz):
+    if "dateTime" in value:
+        return datetime.fromisoformat(value["dateTime"])
+    # All-day events are anchored to midnight in the calendar's zone.
+    d = datetime.strptime(value["date"], "%Y-%m-%d")
+    return d.replace(tzinfo=tz)
+
+
+def _format_like(value, dt):
+    if "dateTime" in value:
+        return {**value, "dateTime": dt.isoformat()}
+    return {**value, "date": dt.strftime("%Y-%m-%d")}
+
+
+def _match_private(ev, props):
+    private = ev.get("extendedProperties", {}).get("private", {})
+    for prop in props:
+        key, _, val = prop.partition("=")
+        if private.get(key) != val:
+            return False
+    return True
+
+
+def _public(ev):
+    return {k: v for k, v in ev.items() if not k.startswith("_")}
+
+
+def _parse_fields(spec):
+    """Partial-response syntax ("items(id,start/dateTime),nextPageToken") -> nested dict."""
+    tree, stack, name = {}, [], ""
+    node = tree
+
+    def close(name, node):
+        if name:
+            parts = name.strip().split("/")
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node.setdefault(parts[-1], True)
+        return node
+
+    for ch in spec:
+        if ch == ",":
+            close(name, node)
+            name = ""
+        elif ch == "(":
+            parent = close(name, node)
+            last = name.strip().split("/")[-1]
+            if parent[last] is True:
+                parent[last] = {}
+            stack.append(node)
+            node, name = parent[last], ""
+        elif ch == ")":
+            close(name, node)
+            node, name = stack.pop(), ""
+        else:
+            name += ch
+    close(name, node)
+    return tree
+
+
+def _project(value, tree):
+    if tree is True:
+        return value
+    if isinstance(value, list):
+        return [_project(v, tree) for v in value]
+    if isinstance(value, dict):
+        return {k: _project(value[k], sub) for k, sub in tree.items() if k in value}
+    return value
+
+
+class _Request:
+    """Mimics googleapiclient's HttpRequest: nothing happens until execute()."""
+
+    def __init__(self, service, fn):
+        self._svc = service
+        self._fn = fn
+
+    def execute(self, num_retries=0):
+        self._svc._sleep()
+        return self._fn()
+
+
+class _Batch:
+    """Mimics BatchHttpRequest: one round trip, per-request callbacks."""
+
+    def __init__(self, service, callback=None):
+        self._svc = service
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if request_id is None:
+            request_id = str(len(self._requests) + 1)
+        self._requests.append((request_id, request, callback or self._callback))
+
+    def execute(self):
+        self._svc._sleep()
+        self._svc.batches += 1
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._fn(), None
+            except HttpError as e:
+                response, exception = None, e
+            if callback:
+                callback(request_id, response, exception)
+
+
+class _Events:
+    def __init__(self, service):
+        self._svc = service
+
+    def list(self, calendarId, timeMin=None, timeMax=None, singleEvents=False,
+             privateExtendedProperty=None, orderBy=None, maxResults=250,
+             pageToken=None, syncToken=None, showDeleted=False, fields=None, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                if syncToken is not None:
+                    if timeMin or timeMax or privateExtendedProperty:
+                        raise _http_error(400, "syncToken cannot be combined with filters")
+                    since = svc._token_version(syncToken)
+                    items = [_public(ev) for ev in svc._calendar(calendarId).values() if ev["_v"] > since]
+                else:
+                    items = self._query(calendarId, timeMin, timeMax, singleEvents,
+                                        privateExtendedProperty, showDeleted)
+                    if orderBy == "startTime":
+                        items.sort(key=lambda ev: _parse_time(ev["start"], svc.tz))
+                version = svc._version
+
+            start = int(pageToken) if pageToken else 0
+            page = items[start:start + maxResults]
+            result = {"kind": "calendar#events", "items": page}
+            if start + maxResults < len(items):
+                result["nextPageToken"] = str(start + maxResults)
+            else:
+                result["nextSyncToken"] = f"sync{version}"
+            return _project(result, _parse_fields(fields)) if fields else result
+
+        return _Request(svc, run)
+
+    def _query(self, calendar_id, time_min, time_max, single_events, private_props, show_deleted):
+        svc = self._svc
+        lo = datetime.fromisoformat(time_min) if time_min else None
+        hi = datetime.fromisoformat(time_max) if time_max else None
+        props = private_props or []
+        if isinstance(props, str):
+            props = [props]
+
+        items = []
+        for ev in svc._calendar(calendar_id).values():
+            if ev.get("status") == "cancelled" and not show_deleted:
+                continue
+            if props and not _match_private(ev, props):
+                continue
+            instances = svc._expand(ev, lo, hi) if single_events and ev.get("recurrence") else [ev]
+            for inst in instances:
+                if lo and _parse_time(inst["end"], svc.tz) <= lo:
+                    continue
+                if hi and _parse_time(inst["start"], svc.tz) >= hi:
+                    continue
+                items.append(_public(inst))
+        return items
+
+    def get(self, calendarId, eventId, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                ev = svc._calendar(calendarId).get(eventId)
+                if ev is None:
+                    raise _http_error(404, "Not Found")
+                return _public(ev)
+
+        return _Request(svc, run)
+
+    def insert(self, calendarId, body, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                ev = copy.deepcopy(body)
+                ev["id"] = f"fake{next(svc._ids)}"
+                ev["status"] = "confirmed"
+                svc._touch(ev)
+                svc._calendar(calendarId)[ev["id"]] = ev
+                return _public(ev)
+
+        return _Request(svc, run)
+
+    def import_(self, calendarId, body, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                cal = svc._calendar(calendarId)
+                # Same iCalUID = the same event, updated in place.
+                ev = next((e for e in cal.values() if e.get("iCalUID") == body["iCalUID"]), None)
+                if ev is None:
+                    ev = {"id": f"fake{next(svc._ids)}"}
+                    cal[ev["id"]] = ev
+                ev.update(copy.deepcopy(body))
+                ev["status"] = "confirmed"
+                svc._touch(ev)
+                return _public(ev)
+
+        return _Request(svc, run)
+
+    def patch(self, calendarId, eventId, body, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                ev = svc._calendar(calendarId).get(eventId)
+                if ev is None or ev.get("status") == "cancelled":
+                    raise _http_error(404, "Not Found")
+                ev.update(copy.deepcopy(body))
+                svc._touch(ev)
+                return _public(ev)
+
+        return _Request(svc, run)
+
+    def delete(self, calendarId, eventId, **kwargs):
+        svc = self._svc
+
+        def run():
+            with svc._lock:
+                ev = svc._calendar(calendarId).get(eventId)
+                if ev is None:
+                    raise _http_error(404, "Not Found")
+                if ev.get("status") == "cancelled":
+                    raise _http_error(410, "Resource has been deleted")
+                # Keep a tombstone so incremental sync can report the delete.
+                ev["status"] = "cancelled"
+                svc._touch(ev)
+                return ""
+
+        return _Request(svc, run)
+
+
+class FakeCalendarService:
+    """Drop-in for build("calendar", "v3", ...) covering the calls plan_trip makes.
+
+    latency/jitter (seconds) are slept on every execute(), once per batch.
+    """
+
+    def __init__(self, tz=timezone.utc, latency=0.0, jitter=0.0, seed=0):
+        self.tz = tz
+        self.latency = latency
+        self.jitter = jitter
+        self.batches = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.RLock()
+        self._calendars = {}
+        self._ids = itertools.count(1)
+        self._version = 0
+
+    # ---------- googleapiclient surface ----------
+    def events(self):
+        return _Events(self)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+    # ---------- helpers ----------
+    def _sleep(self):
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self._rng.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _calendar(self, calendar_id):
+        return self._calendars.setdefault(calendar_id, {})
+
+    def _touch(self, ev):
+        self._version += 1
+        ev["_v"] = self._version
+        # Deterministic, but changes on every write like the real one.
+        ev["updated"] = (datetime(2000, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=self._version)).isoformat()
+
+    def _token_version(self, token):
+        if not token.startswith("sync") or int(token[4:]) > self._version:
+            raise _http_error(410, "Sync token is no longer valid, a full sync is required.")
+        return int(token[4:])
+
+    def _expand(self, ev, lo, hi):
+        start = _parse_time(ev["start"], self.tz)
+        duration = _parse_time(ev["end"], self.tz) - start
+        rule = rrulestr("\n".join(ev["recurrence"]), dtstart=start)
+
+        instances = []
+        for occ in rule:
+            if hi and occ >= hi:
+                break
+            if len(instances) >= MAX_INSTANCES:
+                break
+            if lo and occ + duration <= lo:
+                continue
+            inst = {k: v for k, v in ev.items() if k != "recurrence"}
+            inst["id"] = f"{ev['id']}_{occ.astimezone(timezone.utc):%Y%m%dT%H%M%SZ}"
+            inst["recurringEventId"] = ev["id"]
+            inst["originalStartTime"] = _format_like(ev["start"], occ)
+            inst["start"] = _format_like(ev["start"], occ)
+            inst["end"] = _format_like(ev["end"], occ + duration)
+            instances.append(inst)
+        return instances
+
+    # ---------- record / replay ----------
+    def seed(self, calendar_id, events):
+        for body in events:
+            self.events().insert(calendarId=calendar_id, body=body).execute()
+
+    def dump(self, path):
+        with self._lock:
+            data = {cal: [_public(ev) for ev in evs.values() if ev.get("status") != "cancelled"]
+                    for cal, evs in self._calendars.items()}
+        with open(path, "w") as f:
+            json.dump(data, f, indent=2)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        svc = cls(**kwargs)
+        with open(path) as f:
+            data = json.load(f)
+        for calendar_id, events in data.items():
+            for body in events:
+                body = {k: v for k, v in body.items() if k not in ("id", "status", "updated")}
+                svc.events().insert(calendarId=calendar_id, body=body).execute()
+        return svc
+
+
+def record_calendar(service, calendar_id, path, time_min=None, time_max=None):
+    """Snapshot a live calendar (master events, not instances) into a replayable fixture."""
+    items = list(calendar_list.list_events(service, calendar_id, timeMin=time_min, timeMax=time_max))
+    with open(path, "w") as f:
+        json.dump({calendar_id: items}, f, indent=2)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_service(fixture=None, **kwargs):
+    """One fake per process so every Streamlit session sees the same calendar."""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = FakeCalendarService.load(fixture, **kwargs) if fixture else FakeCalendarService(**kwargs)
+        return _shared
@@ -0,0 +1,150 @@
+# ============================================
+# Filename: flight_cache.py
+# Purpose: Per-route cache of raw SerpAPI responses
+# One file per (origin, dest, date) so legs can be refreshed independently
+#
+# CACHE_DIR can be shared by every planner on a team (a common disk or
+# network mount). A miss takes a per-route file lock before fetching, so
+# concurrent identical searches - from other threads or other processes -
+# wait for the first one and reuse its result instead of spending credits.
+# Entries are written to a temp file and renamed into place, so readers never
+# see half a file; one that is unreadable anyway counts as a miss.
+# ============================================
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process coalescing
+    fcntl = None
+
+import metrics
+
+CACHE_DIR = os.getenv("PLANNER_CACHE_DIR", "flight_cache")
+
+_key_locks = {}  # key -> threading.Lock; file locks alone don't order threads everywhere
+_key_locks_guard = threading.Lock()
+
+
+def route_key(origin, dest, date, source="serpapi"):
+    key = f"{origin}_{dest}_{date}"
+    # SerpAPI entries keep the original unprefixed names.
+    return key if source == "serpapi" else f"{source}_{key}"
+
+
+def _path(key):
+    return os.path.join(CACHE_DIR, f"{key}.json")
+
+
+def read(key):
+    """Cached entry {"fetched_at": epoch seconds, "raw": payload}, or None."""
+    path = _path(key)
+    try:
+        with open(path) as f:
+            entry = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # Truncated or garbled (e.g. written by an older, non-atomic version):
+        # refetched and replaced by the next get_route.
+        metrics.inc("cache_corrupt", cache="flights")
+        return None
+    if not isinstance(entry, dict) or "fetched_at" not in entry or "raw" not in entry:
+        metrics.inc("cache_corrupt", cache="flights")
+        return None
+    return entry
+
+
+def write(key, raw, fetched_at=None):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    entry = {"fetched_at": fetched_at if fetched_at is not None else time.time(), "raw": raw}
+    # Unique temp name: other threads and processes may be writing the same key.
+    fd, tmp = tempfile.mkstemp(prefix=f".{key}.", suffix=".tmp", dir=CACHE_DIR)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+        # mtime mirrors fetched_at so freshness checks don't have to parse the file.
+        os.utime(tmp, (entry["fetched_at"], entry["fetched_at"]))
+        os.replace(tmp, _path(key))
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return entry
+
+
+def fetched_at(key):
+    path = _path(key)
+    return os.path.getmtime(path) if os.path.exists(path) else None
+
+
+@contextmanager
+def _locked(key):
+    """Exclusive per-route lock shared by every thread and process using CACHE_DIR."""
+    with _key_locks_guard:
+        thread_lock = _key_locks.setdefault(key, threading.Lock())
+    with thread_lock:
+        if fcntl is None:
+            yield
+            return
+        lock_dir = os.path.join(CACHE_DIR, ".locks")
+        os.makedirs(lock_dir, exist_ok=True)
+        with open(os.path.join(lock_dir, f"{key}.lock"), "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _fresh(entry, max_age):
+    return entry is not None and (max_age is None or time.time() - entry["fetched_at"] < max_age)
+
+
+def get_route(origin, dest, date, fetch, max_age=None, source="serpapi"):
+    """Return the cached entry for a route, calling fetch(origin, dest, date) on a miss.
+
+    max_age=None means any cached copy is good enough (the original behaviour).
+    """
+    key = route_key(origin, dest, date, source)
+    entry = read(key)
+    if _fresh(entry, max_age):
+        metrics.inc("cache_requests", cache="flights", result="hit")
+        return entry
+
+    with _locked(key):
+        # Someone else may have fetched it while we waited for the lock.
+        entry = read(key)
+        if _fresh(entry, max_age):
+            metrics.inc("cache_requests", cache="flights", result="hit")
+            metrics.inc("cache_fetches_shared", cache="flights")
+            return entry
+
+        metrics.inc("cache_requests", cache="flights", result="miss")
+        return write(key, fetch(origin, dest, date))
+
+
+def import_trip_file(path, outbound, inbound):
+    """Seed the per-route cache from an old flights_{...}.json trip file.
+
+    outbound/inbound are (origin, dest, date) tuples. Existing entries win.
+    """
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path) as f:
+            raw = json.load(f)
+    except ValueError:
+        print(f"Skipping unreadable trip file {path}")
+        return
+    fetched_at = os.path.getmtime(path)
+    for leg, name in ((outbound, "outbound_raw"), (inbound, "inbound_raw")):
+        key = route_key(*leg)
+        if read(key) is None and name in raw:
+            write(key, raw[name], fetched_at)
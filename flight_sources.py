@@ -0,0 +1,240 @@
+# ============================================
+# Filename: flight_sources.py
+# Purpose: Pluggable flight providers queried in parallel
+# Every provider returns a SerpAPI-shaped payload ({"best_flights", "other_flights"})
+# so extract_flights / dedup_flights / the cache treat all sources the same
+# ============================================
+
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from amadeus import Client, ResponseError
+
+import flight_cache
+import metrics
+
+# Shared so that a provider we stopped waiting for can still finish in the
+# background and land in the cache for the next rerun.
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="flight-source")
+_in_flight = {}  # cache key -> Future, so reruns join a fetch instead of repeating it
+_lock = threading.Lock()
+# Per-airport requests for providers that can't search several airports at
+# once; separate from _executor, whose workers wait on these.
+_airport_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="flight-airport")
+
+
+# -----------------------------------------------------
+# PROVIDERS
+# -----------------------------------------------------
+class SerpApiProvider:
+    # departure_id/arrival_id take comma-separated airports ("IAH,HOU"), so a
+    # whole metro area is one request.
+    multi_airport = True
+
+    # deep=False is the quick first pass: a plain Google Flights query that comes
+    # back in a second or two. It is skipped once the deep result is cached.
+    def __init__(self, fetch, deep=True, timeout=None):
+        self._fetch = fetch
+        self.deep = deep
+        self.name = "serpapi" if deep else "serpapi_fast"
+        self.superseded_by = None if deep else "serpapi"
+        self.timeout = timeout or (60 if deep else 15)
+
+    def fetch(self, origin, dest, date):
+        return self._fetch(origin, dest, date, deep=self.deep)
+
+
+class AmadeusProvider:
+    name = "amadeus"
+    superseded_by = None
+    multi_airport = False
+
+    def __init__(self, client_id, client_secret, timeout=20, max_offers=50):
+        self._client = Client(client_id=client_id, client_secret=client_secret)
+        self.timeout = timeout
+        self.max_offers = max_offers
+
+    def fetch(self, origin, dest, date):
+        metrics.inc("amadeus_calls")
+        try:
+            response = self._client.shopping.flight_offers_search.get(
+                originLocationCode=origin,
+                destinationLocationCode=dest,
+                departureDate=date,
+                adults=1,
+                currencyCode="USD",
+                max=self.max_offers,
+            )
+        except ResponseError as error:
+            raise RuntimeError(f"Amadeus search failed: {error}") from error
+        carriers = response.result.get("dictionaries", {}).get("carriers", {})
+        return {"other_flights": [amadeus_block(offer, carriers) for offer in response.data]}
+
+
+def _minutes(iso_duration):
+    m = re.fullmatch(r"PT(?:(\d+)H)?(?:(\d+)M)?", iso_duration or "")
+    if not m:
+        return None
+    return int(m.group(1) or 0) * 60 + int(m.group(2) or 0)
+
+
+def amadeus_block(offer, carriers):
+    """One Amadeus flight offer (first itinerary) as a SerpAPI flight block."""
+    flights = []
+    for seg in offer["itineraries"][0]["segments"]:
+        code = seg["carrierCode"]
+        flights.append({
+            "departure_airport": {"id": seg["departure"]["iataCode"], "time": seg["departure"]["at"][:16].replace("T", " ")},
+            "arrival_airport": {"id": seg["arrival"]["iataCode"], "time": seg["arrival"]["at"][:16].replace("T", " ")},
+            "duration": _minutes(seg.get("duration")),
+            "airline": carriers.get(code, code).title(),
+            "flight_number": f"{code} {seg['number']}",
+            "airplane": seg.get("aircraft", {}).get("code"),
+        })
+    return {
+        "flights": flights,
+        "total_duration": _minutes(offer["itineraries"][0].get("duration")),
+        "price": round(float(offer["price"]["total"])),
+    }
+
+
+def make_providers(names, serpapi_fetch, amadeus_id=None, amadeus_secret=None, timeout=None):
+    providers = []
+    for name in names:
+        if name == "serpapi":
+            providers.append(SerpApiProvider(serpapi_fetch))
+        elif name == "serpapi_fast":
+            providers.append(SerpApiProvider(serpapi_fetch, deep=False))
+        elif name == "amadeus":
+            if not (amadeus_id and amadeus_secret):
+                raise ValueError("Amadeus provider needs AMADEUS_CLIENT_ID and AMADEUS_CLIENT_SECRET.")
+            providers.append(AmadeusProvider(amadeus_id, amadeus_secret))
+        else:
+            raise ValueError(f"Unknown flight provider: {name}")
+        if timeout:
+            providers[-1].timeout = timeout
+    return providers
+
+
+def fetch_each_airport(fetch, origin, dest, date):
+    """One payload for comma-separated origin/dest airports, one request per pair.
+
+    The pairs run in parallel and their flights are concatenated; duplicates
+    are left to dedup_flights like any other overlap between sources.
+    """
+    pairs = [(o, d) for o in origin.split(",") for d in dest.split(",")]
+    if len(pairs) == 1:
+        return fetch(origin, dest, date)
+    payloads = list(_airport_executor.map(lambda pair: fetch(*pair, date), pairs))
+    return {
+        "best_flights": [b for payload in payloads for b in payload.get("best_flights", [])],
+        "other_flights": [b for payload in payloads for b in payload.get("other_flights", [])],
+    }
+
+
+def _fetcher(p):
+    if p.multi_airport:
+        return p.fetch
+    return lambda origin, dest, date: fetch_each_airport(p.fetch, origin, dest, date)
+
+
+# -----------------------------------------------------
+# FAN-OUT
+# -----------------------------------------------------
+def cache_keys(names, routes):
+    return [flight_cache.route_key(*route, source=name) for route in routes for name in names]
+
+
+def submit(route, fetch, source, max_age=None):
+    """Cached fetch of one route on the shared pool; joins an identical fetch in flight."""
+    key = flight_cache.route_key(*route, source=source)
+    with _lock:
+        fut = _in_flight.get(key)
+        if fut is not None:
+            return fut
+        fut = _executor.submit(flight_cache.get_route, *route, fetch, max_age=max_age, source=source)
+        _in_flight[key] = fut
+    # Outside the lock: the callback runs right away if the fetch already finished.
+    fut.add_done_callback(lambda done: _forget(key, done))
+    return fut
+
+
+def _forget(key, fut):
+    with _lock:
+        if _in_flight.get(key) is fut:
+            del _in_flight[key]
+
+
+def pending(names, routes):
+    """Cache keys among these providers/routes still being fetched in the background."""
+    with _lock:
+        return [k for k in cache_keys(names, routes) if k in _in_flight]
+
+
+def _superseded(route, p, max_age):
+    if not p.superseded_by:
+        return False
+    fetched = flight_cache.fetched_at(flight_cache.route_key(*route, source=p.superseded_by))
+    return fetched is not None and (max_age is None or time.time() - fetched < max_age)
+
+
+def iter_results(providers, routes, max_age=None):
+    """Yield (route, provider name, cache entry) as each answer arrives.
+
+    All (route, provider) pairs run at once through the cache. A provider that
+    exceeds its own timeout is skipped, not cancelled: it keeps running and its
+    result is cached for later.
+    """
+    started = time.monotonic()
+    waiting = {}
+    for route in routes:
+        for p in providers:
+            if not _superseded(route, p, max_age):
+                waiting[submit(route, _fetcher(p), p.name, max_age)] = (route, p)
+
+    while waiting:
+        now = time.monotonic()
+        for fut, (route, p) in list(waiting.items()):
+            if not fut.done() and now - started >= p.timeout:
+                metrics.inc("provider_timeouts", provider=p.name)
+                del waiting[fut]
+        if not waiting:
+            break
+
+        next_deadline = min(started + p.timeout for _, p in waiting.values())
+        done, _ = wait(waiting, timeout=max(0, next_deadline - now), return_when=FIRST_COMPLETED)
+        for fut in done:
+            route, p = waiting.pop(fut)
+            try:
+                entry = fut.result()
+            except Exception as e:
+                metrics.inc("provider_errors", provider=p.name)
+                print(f"{p.name} failed for {route}:", e)
+                continue
+            metrics.inc("provider_results", provider=p.name)
+            yield route, p.name, entry
+
+
+def search_routes(providers, routes, parse, adequate=None, max_age=None):
+    """Merged itineraries per route from all providers that answer in time.
+
+    Returns ({route: [payloads parsed by parse]}, {cache key: fetched_at}).
+    With adequate=N, stop waiting once every route has N itineraries.
+    """
+    parsed = {route: [] for route in routes}
+    fetched = {}
+    for route, source, entry in iter_results(providers, routes, max_age):
+        parsed[route].append(parse(entry["raw"]))
+        fetched[flight_cache.route_key(*route, source=source)] = entry["fetched_at"]
+        if adequate and all(sum(map(len, lists)) >= adequate for lists in parsed.values()):
+            break
+
+    # Note skipped first-pass entries too, so they don't look like new results later.
+    for route in routes:
+        for p in providers:
+            key = flight_cache.route_key(*route, source=p.name)
+            if key not in fetched and _superseded(route, p, max_age) and flight_cache.fetched_at(key):
+                fetched[key] = flight_cache.fetched_at(key)
+    return parsed, fetched
@@ -0,0 +1,184 @@
+# ============================================
+# Filename: itinerary.py
+# Purpose: Compact parsed-itinerary records
+# Airports, airlines, aircraft and cabin classes are dictionary-encoded to
+# small ints, times are ints (wall-clock minutes), and records use __slots__.
+# Records still answer f["price"] / seg["dep_time"] like the old dicts.
+# ============================================
+
+import threading
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+
+class StringPool:
+    """Dictionary encoding: each distinct string is stored once and referred to by index."""
+
+    def __init__(self):
+        self._ids = {}
+        self._strings = []
+        self._lock = threading.Lock()
+
+    def code(self, s):
+        if s is None:
+            return -1
+        i = self._ids.get(s)
+        if i is None:
+            with self._lock:
+                i = self._ids.setdefault(s, len(self._strings))
+                if i == len(self._strings):
+                    self._strings.append(s)
+        return i
+
+    def text(self, i):
+        return None if i < 0 else self._strings[i]
+
+    def __len__(self):
+        return len(self._strings)
+
+
+# Process-wide so codes mean the same thing for every session and search.
+AIRPORTS = StringPool()
+AIRLINES = StringPool()
+AIRCRAFT = StringPool()
+CLASSES = StringPool()
+
+
+def to_minutes(s):
+    """"YYYY-MM-DD HH:MM" (airport-local wall clock) -> int minutes."""
+    d = datetime(int(s[0:4]), int(s[5:7]), int(s[8:10]))
+    return d.toordinal() * 1440 + int(s[11:13]) * 60 + int(s[14:16])
+
+
+def datetime_minutes(dt):
+    """Wall-clock minutes of a datetime (tz-aware values use their own wall clock)."""
+    return dt.toordinal() * 1440 + dt.hour * 60 + dt.minute
+
+
+def from_minutes(m):
+    d = datetime.fromordinal(m // 1440) + timedelta(minutes=m % 1440)
+    return d.strftime("%Y-%m-%d %H:%M")
+
+
+class _Record:
+    __slots__ = ()
+
+    # Mapping-style access so existing f["price"] / seg["dep"] code keeps working.
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def __contains__(self, name):
+        return getattr(self, name, None) is not None
+
+
+class Segment(_Record):
+    __slots__ = ("dep_code", "arr_code", "dep_min", "arr_min", "airline_code",
+                 "flight_number", "duration", "aircraft_code", "class_code")
+
+    def __init__(self, seg):
+        self.dep_code = AIRPORTS.code(seg["departure_airport"]["id"])
+        self.arr_code = AIRPORTS.code(seg["arrival_airport"]["id"])
+        self.dep_min = to_minutes(seg["departure_airport"]["time"])
+        self.arr_min = to_minutes(seg["arrival_airport"]["time"])
+        self.airline_code = AIRLINES.code(seg.get("airline", "Unknown"))
+        self.flight_number = seg.get("flight_number")
+        self.duration = seg.get("duration")
+        self.aircraft_code = AIRCRAFT.code(seg.get("airplane"))
+        self.class_code = CLASSES.code(seg.get("travel_class"))
+
+    dep = property(lambda self: AIRPORTS.text(self.dep_code))
+    arr = property(lambda self: AIRPORTS.text(self.arr_code))
+    dep_time = property(lambda self: from_minutes(self.dep_min))
+    arr_time = property(lambda self: from_minutes(self.arr_min))
+    airline = property(lambda self: AIRLINES.text(self.airline_code))
+    airplane = property(lambda self: AIRCRAFT.text(self.aircraft_code))
+    travel_class = property(lambda self: CLASSES.text(self.class_code))
+
+
+class Itinerary(_Record):
+    __slots__ = ("id", "key", "price", "total_duration", "carbon", "layovers",
+                 "booking_token", "departure_token", "segments",
+                 "min_layover", "max_layover", "overnight", "airport_change", "_fit")
+
+    def __init__(self, flight_id, key, block):
+        self.id = flight_id
+        self.key = key
+        self.price = block.get("price")
+        self.total_duration = block.get("total_duration")
+        self.carbon = block.get("carbon_emissions", {}).get("this_flight")
+        self.booking_token = block.get("booking_token")
+        # Round-trip outbound options carry the token that lists their returns.
+        self.departure_token = block.get("departure_token")
+        self.segments = tuple(Segment(seg) for seg in block.get("flights", []))
+
+        # Connection profile, computed once so filtering never walks segments.
+        # Both ends of a layover are on the connecting airport's clock.
+        flagged = [bool(lay.get("overnight")) for lay in block.get("layovers", [])]
+        self.layovers = tuple(
+            (a.arr_code, b.dep_min - a.arr_min,
+             a.arr_min // 1440 != b.dep_min // 1440 or (i < len(flagged) and flagged[i]))
+            for i, (a, b) in enumerate(zip(self.segments, self.segments[1:]))
+        )  # (airport code, minutes, overnight) per connection
+        minutes = [m for _, m, _ in self.layovers]
+        self.min_layover = min(minutes, default=None)
+        self.max_layover = max(minutes, default=None)
+        self.overnight = any(o for _, _, o in self.layovers)
+        self.airport_change = any(a.arr_code != b.dep_code for a, b in zip(self.segments, self.segments[1:]))
+        self._fit = None
+
+    @property
+    def stops(self):
+        return len(self.segments) - 1
+
+    @property
+    def dep_min(self):
+        return self.segments[0].dep_min
+
+    @property
+    def arr_min(self):
+        return self.segments[-1].arr_min
+
+
+class ConnectionRules:
+    """Minimum connection time (per airport, else a default) and layover limits."""
+
+    def __init__(self, min_connection, per_airport=(), max_layover=None,
+                 allow_overnight=True, allow_airport_change=True):
+        self.min_connection = min_connection
+        self.per_airport = {AIRPORTS.code(airport): m for airport, m in per_airport}
+        self.max_layover = max_layover
+        self.allow_overnight = allow_overnight
+        self.allow_airport_change = allow_airport_change
+
+    def _check(self, f):
+        if not f.layovers:
+            return True
+        if f.overnight and not self.allow_overnight:
+            return False
+        if f.airport_change and not self.allow_airport_change:
+            return False
+        if self.max_layover is not None and f.max_layover > self.max_layover:
+            return False
+        if not self.per_airport:
+            return f.min_layover >= self.min_connection
+        return all(m >= self.per_airport.get(code, self.min_connection) for code, m, _ in f.layovers)
+
+    def allows(self, f):
+        # The verdict is cached on the itinerary for as long as these rules are in use.
+        fit = f._fit
+        if fit is None or fit[0] is not self:
+            fit = f._fit = (self, self._check(f))
+        return fit[1]
+
+
+@lru_cache(maxsize=32)
+def connection_rules(min_connection, per_airport=(), max_layover=None,
+                     allow_overnight=True, allow_airport_change=True):
+    """Shared ConnectionRules per setting, so cached verdicts survive reruns."""
+    return ConnectionRules(min_connection, per_airport, max_layover, allow_overnight, allow_airport_change)
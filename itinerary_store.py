@@ -0,0 +1,120 @@
+# ============================================
+# Filename: itinerary_store.py
+# Purpose: Process-wide LRU of parsed itineraries, shared by all sessions
+# Sessions keep only a handle (a small hashable key). Entries are kept within
+# a byte budget; sessions idle for longer than idle_seconds stop pinning
+# theirs, so abandoned browser tabs stop holding memory. An evicted entry is
+# rebuilt from the flight cache the next time its handle is used.
+# ============================================
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+import metrics
+
+
+def deep_size(obj, seen=None):
+    """Approximate bytes held by obj: lists/tuples/dicts and __slots__ records, each object once."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in obj)
+    elif isinstance(obj, dict):
+        size += sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    else:
+        for cls in type(obj).__mro__:
+            for name in getattr(cls, "__slots__", ()):
+                if hasattr(obj, name):
+                    size += deep_size(getattr(obj, name), seen)
+    return size
+
+
+class ItineraryStore:
+    def __init__(self, budget_bytes, idle_seconds):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # handle -> (value, bytes), least recently used first
+        self._bytes = 0
+        self._sessions = {}             # session id -> (last seen, handle)
+
+    def put(self, handle, value):
+        """Store value under handle (replacing any previous value) and return the handle."""
+        size = deep_size(value)
+        with self._lock:
+            old = self._entries.pop(handle, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[handle] = (value, size)
+            self._bytes += size
+            self._evict()
+        return handle
+
+    def get(self, handle, load):
+        """The value for handle; load() rebuilds it if it was evicted."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is not None:
+                self._entries.move_to_end(handle)
+                metrics.inc("itinerary_store_requests", result="hit")
+                return entry[0]
+        metrics.inc("itinerary_store_requests", result="miss")
+        value = load()
+        self.put(handle, value)
+        return value
+
+    def touch(self, session, handle):
+        """Note that session is active and uses handle; its entry is kept over idle ones."""
+        with self._lock:
+            self._sessions[session] = (time.time(), handle)
+            self._evict()
+
+    def _evict(self):
+        now = time.time()
+        for session, (seen, _) in list(self._sessions.items()):
+            if now - seen > self.idle_seconds:
+                del self._sessions[session]
+                metrics.inc("sessions_evicted")
+
+        pinned = {handle for _, handle in self._sessions.values()}
+        while self._bytes > self.budget_bytes and len(self._entries) > 1:
+            # Oldest entry no active session uses; failing that, the oldest of
+            # all. The newest is kept: it is the one being used right now.
+            older = list(self._entries)[:-1]
+            victim = next((h for h in older if h not in pinned), older[0])
+            self._bytes -= self._entries.pop(victim)[1]
+            metrics.inc("itinerary_store_evictions")
+
+        metrics.set_gauge("itinerary_store_bytes", self._bytes)
+        metrics.set_gauge("itinerary_store_entries", len(self._entries))
+        metrics.set_gauge("active_sessions", len(self._sessions))
+
+    def stats(self):
+        with self._lock:
+            return {
+                "bytes": self._bytes,
+                "budget_bytes": self.budget_bytes,
+                "entries": len(self._entries),
+                "active_sessions": len(self._sessions),
+            }
+
+
+def rss_bytes():
+    """Resident set size of this process (Linux), else its peak RSS, else None."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
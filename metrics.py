@@ -0,0 +1,171 @@
+# ============================================
+# Filename: metrics.py
+# Purpose: Phase timers, API-call counters and cache stats for the planner
+# Exposed in the Streamlit debug panel and as Prometheus text
+# ============================================
+
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Process-wide totals live in this module (not in plan_trip.py) because
+# Streamlit re-executes the script on every rerun but keeps imports cached.
+_lock = threading.Lock()
+_counters = {}   # (name, labels) -> count
+_phases = {}     # phase -> [count, total_seconds]
+_gauges = {}     # (name, labels) -> value
+
+# Per-rerun numbers: each Streamlit session runs its script on its own thread.
+_run = threading.local()
+
+_server = None
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+# -----------------------------------------------------
+# RECORDING
+# -----------------------------------------------------
+def begin_run():
+    _run.counters = {}
+    _run.phases = {}
+
+
+def inc(name, amount=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+    run = getattr(_run, "counters", None)
+    if run is not None:
+        run[key] = run.get(key, 0) + amount
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+@contextmanager
+def timed(phase):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - t0
+        with _lock:
+            entry = _phases.setdefault(phase, [0, 0.0])
+            entry[0] += 1
+            entry[1] += elapsed
+        run = getattr(_run, "phases", None)
+        if run is not None:
+            run[phase] = run.get(phase, 0.0) + elapsed
+
+
+# -----------------------------------------------------
+# READING
+# -----------------------------------------------------
+def _fmt(key):
+    name, labels = key
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in labels) + "}"
+
+
+def run_snapshot():
+    """Timings (ms) and counters recorded since the last begin_run() on this thread."""
+    return {
+        "phases_ms": {p: round(s * 1000, 2) for p, s in getattr(_run, "phases", {}).items()},
+        "counters": {_fmt(k): v for k, v in getattr(_run, "counters", {}).items()},
+    }
+
+
+def cache_hit_rate(cache="flights"):
+    with _lock:
+        hits = _counters.get(_key("cache_requests", {"cache": cache, "result": "hit"}), 0)
+        misses = _counters.get(_key("cache_requests", {"cache": cache, "result": "miss"}), 0)
+    total = hits + misses
+    return (hits / total) if total else None
+
+
+def totals_snapshot():
+    with _lock:
+        return {
+            "phases": {p: {"count": c, "avg_ms": round(s / c * 1000, 2)} for p, (c, s) in _phases.items()},
+            "counters": {_fmt(k): v for k, v in _counters.items()},
+            "gauges": {_fmt(k): v for k, v in _gauges.items()},
+        }
+
+
+def _labels_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+def render_prometheus():
+    lines = []
+    with _lock:
+        counters = dict(_counters)
+        phases = {p: tuple(v) for p, v in _phases.items()}
+        gauges = dict(_gauges)
+
+    seen = set()
+    for (name, labels), value in sorted(counters.items()):
+        metric = f"planner_{name}_total"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} counter")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+    if phases:
+        lines.append("# TYPE planner_phase_seconds summary")
+        for phase, (count, total) in sorted(phases.items()):
+            lines.append(f'planner_phase_seconds_sum{{phase="{phase}"}} {total:.6f}')
+            lines.append(f'planner_phase_seconds_count{{phase="{phase}"}} {count}')
+
+    for (name, labels), value in sorted(gauges.items()):
+        metric = f"planner_{name}"
+        if metric not in seen:
+            lines.append(f"# TYPE {metric} gauge")
+            seen.add(metric)
+        lines.append(f"{metric}{_labels_text(labels)} {value}")
+
+    rate = cache_hit_rate()
+    if rate is not None:
+        lines.append("# TYPE planner_cache_hit_ratio gauge")
+        lines.append(f"planner_cache_hit_ratio {rate:.4f}")
+
+    return "\n".join(lines) + "\n"
+
+
+# -----------------------------------------------------
+# /metrics ENDPOINT
+# -----------------------------------------------------
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(port):
+    """Serve /metrics on a daemon thread. Safe to call on every rerun."""
+    global _server
+    with _lock:
+        if _server is not None:
+            return _server
+        _server = ThreadingHTTPServer(("127.0.0.1", port), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
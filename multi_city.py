@@ -0,0 +1,63 @@
+# ============================================
+# Filename: multi_city.py
+# Purpose: Best whole-trip paths through a multi-city route (A→B→C→…)
+# Each leg's options are nodes of a time-expanded graph; option j of leg k+1
+# follows option i of leg k when it leaves the city at least min_stay after i
+# lands. Costs add up along a path, so a DP over the legs (sorted sweep +
+# running minimum) finds the best path into every option without enumerating
+# combinations.
+# ============================================
+
+from bisect import bisect_right
+
+# Per-option cost of a path for each objective (lower is better).
+OBJECTIVES = {
+    "price": lambda f: f.price if f.price is not None else float("inf"),
+    "duration": lambda f: f.total_duration if f.total_duration is not None else f.arr_min - f.dep_min,
+}
+
+
+def best_paths(legs, objective="price", min_stay=0, limit=20):
+    """Cheapest (or fastest) feasible paths, best first.
+
+    legs: one list of itineraries per leg. Times are wall-clock minutes, and a
+    connection compares an arrival and a departure at the same city, so both
+    are on the same clock. Returns up to `limit` (cost, (f0, f1, …)) - the best
+    path ending in each final-leg option.
+    """
+    cost_of = OBJECTIVES[objective]
+    if not legs or any(not options for options in legs):
+        return []
+
+    # best[i]: cost of the best path ending in option i of the current leg;
+    # back[leg][i]: the option of the leg before that this path came through.
+    prev = legs[0]
+    best = [cost_of(f) for f in prev]
+    back = [[None] * len(prev)]
+
+    for options in legs[1:]:
+        # Previous options by arrival; prefix[k] is the best among the first k+1.
+        order = sorted(range(len(prev)), key=lambda i: prev[i].arr_min)
+        arrivals = [prev[i].arr_min for i in order]
+        prefix = []
+        for i in order:
+            prefix.append(i if not prefix or best[i] < best[prefix[-1]] else prefix[-1])
+
+        new_best, pointers = [], []
+        for f in options:
+            k = bisect_right(arrivals, f.dep_min - min_stay) - 1
+            i = prefix[k] if k >= 0 else None
+            new_best.append(best[i] + cost_of(f) if i is not None else float("inf"))
+            pointers.append(i)
+        prev, best = options, new_best
+        back.append(pointers)
+
+    ends = sorted((c, j) for j, c in enumerate(best) if c != float("inf"))[:limit]
+    paths = []
+    for cost, j in ends:
+        path = []
+        for leg in range(len(legs) - 1, -1, -1):
+            path.append(legs[leg][j])
+            j = back[leg][j]
+        paths.append((cost, tuple(reversed(path))))
+    return paths
@@ -0,0 +1,135 @@
+# ============================================
+# Filename: plan_cli.py
+# Purpose: Terminal front end for the flight planning engine (planner.py)
+# Same data, constraints, ranking and calendar previews as the Streamlit app,
+# without a server or browser - e.g. over SSH:
+#
+#   python plan_cli.py
+#   python plan_cli.py --rank price --min-connection 60
+# ============================================
+
+import argparse
+
+import calendar_writer
+import itinerary
+import planner
+import price_watch
+import ranking
+import trip_export
+
+HELP = ("n/p = next/prev outbound · N/P = next/prev inbound · r <preset> = rank by · "
+        "a = add to trip plan · x <file.ics|file.json|calendar> = export plan · q = quit")
+
+
+def show_leg(title, flights, pareto, idx, route_key):
+    if not flights:
+        print(f"{title}: no flights fit your schedule")
+        return
+    f = flights[idx]
+    star = " ⭐" if pareto[idx] else ""
+    print(f"{title} {idx + 1}/{len(flights)}{star}  ${f['price']}")
+    for s in f["segments"]:
+        print(f"   {s['dep']} → {s['arr']}  {s['dep_time']} → {s['arr_time']}  {s['flight_number'] or ''}")
+    if f.layovers:
+        print(f"   layovers: {planner.layover_summary(f)}")
+    change = price_watch.price_change(route_key, f)
+    if change and change[1] != change[0]:
+        print(f"   was ${change[0]} when first seen")
+
+
+def export_plan(target):
+    plan = trip_export.load_plan()
+    if not plan:
+        print("no trips planned yet (a = add the current selection)")
+    elif target == "calendar":
+        planner.queue_plan_import(plan)
+        print(f"{len(plan)} trip(s) queued for one batched calendar import")
+    elif target.endswith((".ics", ".json")):
+        with open(target, "w", newline="") as f:
+            f.write(trip_export.to_ics(plan, planner.TZ) if target.endswith(".ics") else trip_export.to_json(plan))
+        print(f"wrote {len(plan)} trip(s) to {target}")
+    else:
+        print("usage: x <file.ics|file.json|calendar>")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cycle through calendar-compatible flights in the terminal.")
+    parser.add_argument("--rank", choices=list(ranking.PRESETS), default="balanced")
+    parser.add_argument("--min-connection", type=int, default=planner.MIN_CONNECTION, help="minutes")
+    parser.add_argument("--max-layover-hours", type=int, default=planner.MAX_LAYOVER_HOURS, help="0 = any")
+    parser.add_argument("--no-overnight", action="store_true", help="reject overnight layovers")
+    parser.add_argument("--no-airport-change", action="store_true", help="reject changing airports")
+    args = parser.parse_args()
+    if planner.MULTI_CITY:
+        parser.error("PLANNER_TRIP_MODE=multi_city is only available in the Streamlit app")
+
+    rules = itinerary.connection_rules(
+        args.min_connection, planner.AIRPORT_MIN_CONNECTION, args.max_layover_hours * 60 or None,
+        not args.no_overnight, not args.no_airport_change,
+    )
+    weights = ranking.PRESETS[args.rank]
+
+    service = planner.get_calendar_service()
+    planner.start_calendar_writer()
+    state = planner.new_state()
+
+    print(HELP)
+    while True:
+        reloaded = not planner.ROUND_TRIP and planner.cache_updated(state["fetched_at"])
+        if reloaded:
+            planner.store_flights(state, *planner.load_flights())
+
+        valid_out, pareto_out, valid_in, pareto_in = planner.plan_options(service, state, rules, weights, reloaded)
+
+        print()
+        show_leg("Outbound", valid_out, pareto_out, state["idx_out"], planner.OUT_KEY)
+        show_leg("Inbound ", valid_in, pareto_in, state["idx_in"], planner.IN_KEY)
+        # Same coalescing background path as the web app: holding n only sends
+        # the preview you stop on.
+        if valid_out:
+            state["key_out"] = valid_out[state["idx_out"]]["key"]
+            planner.queue_preview(valid_out, state["idx_out"], "outbound", "9")
+        if valid_in:
+            state["key_in"] = valid_in[state["idx_in"]]["key"]
+            planner.queue_preview(valid_in, state["idx_in"], "inbound", "10")
+
+        try:
+            cmd = input("> ").strip()
+        except EOFError:
+            cmd = "q"
+
+        if cmd in ("", "n"):
+            state["idx_out"] += 1
+        elif cmd == "p":
+            state["idx_out"] -= 1
+        elif cmd == "N":
+            state["idx_in"] += 1
+        elif cmd == "P":
+            state["idx_in"] -= 1
+        elif cmd.startswith("r"):
+            preset = cmd[1:].strip()
+            if preset in ranking.PRESETS:
+                weights = ranking.PRESETS[preset]
+                state["idx_out"] = state["idx_in"] = 0
+            else:
+                print("presets:", ", ".join(ranking.PRESETS))
+        elif cmd == "a":
+            if valid_out and valid_in:
+                plan = planner.add_to_plan([("Outbound", valid_out[state["idx_out"]]),
+                                            ("Inbound", valid_in[state["idx_in"]])])
+                print(f"added; {len(plan)} trip(s) planned")
+            else:
+                print("pick an outbound and an inbound flight first")
+        elif cmd.startswith("x"):
+            export_plan(cmd[1:].strip())
+        elif cmd == "q":
+            break
+        else:
+            print(HELP)
+
+    if not calendar_writer.drain(timeout=30):
+        print(f"{calendar_writer.depth()} calendar write(s) still pending; they resume on the next start.")
+
+
+if __name__ == "__main__":
+    main()
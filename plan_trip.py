@@ -1,220 +1,225 @@
 # ============================================
 # Filename: plan_trip.py
-# Purpose: Flight planning engine using SerpAPI + Google Calendar
+# Purpose: Streamlit front end for the flight planning engine (planner.py)
 # UI: Streamlit (no terminal input)
 # ============================================
 
-import json
-import os
-from datetime import datetime, timedelta
-import pytz
-import requests
+from datetime import datetime
 import streamlit as st
 
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-from streamlit.runtime.scriptrunner import add_script_run_ctx
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import time
 
+import calendar_writer
+import flight_sources
+import itinerary
+import itinerary_store
+import metrics
+import multi_city
+import planner
+import price_watch
+import ranking
+import trip_export
 
 # -----------------------------------------------------
-# CONFIG
-# -----------------------------------------------------
-API_KEY = os.getenv("SERPAPI_KEY")
-if not API_KEY:
-    raise ValueError("API_KEY is not set. Please set SERPAPI_KEY.")
-
-ORIGIN = "IAH"
-DEST = "GUA"
-
-DEPART_DATE = "2026-01-22"
-RETURN_DATE = "2026-01-25"
-
-TRIP_NAME = "Texas → Guatemala Trip"
-JSON_FILE = f"flights_{ORIGIN}_{DEST}_{DEPART_DATE}_{RETURN_DATE}.json"
-
-SCOPES = [
-    "https://www.googleapis.com/auth/calendar",
-    "https://www.googleapis.com/auth/calendar.events",
-]
-
-with open("travel_calendar_id.txt", "r") as f:
-    TRAVEL_CAL_ID = f.read().strip()
-
-TZ = pytz.timezone("America/Chicago")
-
-# -----------------------------------------------------
-# GOOGLE CALENDAR AUTH
+# SIDEBAR
 # -----------------------------------------------------
-def get_calendar_service():
-    creds = None
-    if os.path.exists("token.json"):
-        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
-
-    if not creds or not creds.valid:
-        flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
-        creds = flow.run_local_server(port=0)
-        with open("token.json", "w") as t:
-            t.write(creds.to_json())
-
-    return build("calendar", "v3", credentials=creds)
+def sidebar_connection_rules():
+    st.sidebar.subheader("Connections")
+    min_connection = st.sidebar.number_input("Minimum connection (min)", 0, 600, planner.MIN_CONNECTION, step=5)
+    max_hours = st.sidebar.number_input("Longest layover (h, 0 = any)", 0, 48, planner.MAX_LAYOVER_HOURS)
+    overnight = st.sidebar.checkbox("Allow overnight layovers", value=True)
+    airport_change = st.sidebar.checkbox("Allow changing airports", value=True)
+    return itinerary.connection_rules(
+        int(min_connection), planner.AIRPORT_MIN_CONNECTION, int(max_hours) * 60 or None, overnight, airport_change
+    )
 
-# -----------------------------------------------------
-# SERPAPI
-# -----------------------------------------------------
-def fetch_one_way(origin, dest, date):
-    url = "https://serpapi.com/search"
-    params = {
-        "engine": "google_flights",
-        "api_key": API_KEY,
-        "departure_id": origin,
-        "arrival_id": dest,
-        "outbound_date": date,
-        "type": "2",
-        "deep_search": "true",
-    }
-    return requests.get(url, params=params).json()
+def sidebar_what_if(service, state):
+    """Hypothetical calendar edits, kept in the session until applied or discarded."""
+    overlay = st.session_state.setdefault("what_if", {})
+    planner.EVENTS.sync(service)
+    st.sidebar.subheader("What if…")
+
+    days = sorted(set(planner.trip_days(state)))
+    candidates = [ev for day in days for ev in planner.EVENTS.movable(day)]
+    if candidates:
+        pick = st.sidebar.selectbox(
+            "Move activity", range(len(candidates)),
+            format_func=lambda i: f"{candidates[i].get('summary', '(no title)')} · {candidates[i]['start']['dateTime'][:16]}",
+        )
+        minutes = st.sidebar.number_input("by minutes", -720, 720, 60, step=15)
+        if st.sidebar.button("Try move") and minutes:
+            ev = overlay.get(candidates[pick]["id"], candidates[pick])
+            overlay[ev["id"]] = planner.moved_event(ev, int(minutes))
+
+    day = st.sidebar.selectbox("Add activity on", days)
+    start = st.sidebar.time_input("from", datetime.strptime("09:00", "%H:%M").time())
+    end = st.sidebar.time_input("to", datetime.strptime("10:00", "%H:%M").time())
+    if st.sidebar.button("Try activity") and end > start:
+        event_id, ev = planner.new_activity(
+            "What-if activity",
+            planner.TZ.localize(datetime.combine(day, start)), planner.TZ.localize(datetime.combine(day, end)),
+        )
+        overlay[event_id] = ev
+
+    if overlay:
+        for ev in overlay.values():
+            st.sidebar.caption(f"• {ev.get('summary', '(no title)')}: {ev['start']['dateTime'][11:16]}–{ev['end']['dateTime'][11:16]}")
+        if st.sidebar.button("Apply to calendar"):
+            planner.apply_edits(overlay)
+            overlay.clear()
+        if st.sidebar.button("Discard what-if"):
+            overlay.clear()
+    return overlay
+
+def show_changes(title, added, removed):
+    describe = lambda f: (f"${f['price']} {f['segments'][0]['dep_time'][11:]} → "
+                          f"{f['segments'][-1]['arr_time'][11:]} ({f.stops} stop{'s' if f.stops != 1 else ''})")
+    st.write(f"**{title}:** {len(added)} option(s) appear, {len(removed)} disappear")
+    for f in added:
+        st.write(f"＋ {describe(f)}")
+    for f in removed:
+        st.write(f"－ {describe(f)}")
 
 # -----------------------------------------------------
-# PARSER
+# EXPORT
 # -----------------------------------------------------
-def extract_flights(raw):
-    flights = []
-    flight_id = 0
-
-    for block in raw.get("best_flights", []) + raw.get("other_flights", []):
-        segments = []
-        for seg in block.get("flights", []):
-            segments.append({
-                "dep": seg["departure_airport"]["id"],
-                "dep_time": seg["departure_airport"]["time"],
-                "arr": seg["arrival_airport"]["id"],
-                "arr_time": seg["arrival_airport"]["time"],
-                "airline": seg.get("airline", "Unknown"),
-            })
-
-        flights.append({
-            "id": flight_id,
-            "price": block.get("price"),
-            "segments": segments,
-        })
-        flight_id += 1
-
-    return flights
+def show_export(legs):
+    """Add the selection shown to the trip plan; export every planned trip at once."""
+    with st.expander("📦 Trip plan & export"):
+        if legs and st.button("Add this selection to the plan"):
+            planner.add_to_plan(legs)
+        plan = trip_export.load_plan()
+        if not plan:
+            st.caption("No trips planned yet.")
+            return
+        for trip in sorted(plan.values(), key=lambda t: t["start"]):
+            st.write(f"**{trip['name']}** ({trip['start']}): "
+                     + " · ".join(f"{leg['label']} ${leg['price']}" for leg in trip["legs"]))
+        st.download_button("Download .ics", trip_export.to_ics(plan, planner.TZ),
+                           file_name="trip_plan.ics", mime="text/calendar")
+        st.download_button("Download JSON", trip_export.to_json(plan),
+                           file_name="trip_plan.json", mime="application/json")
+        if st.button("Add all to calendar"):
+            planner.queue_plan_import(plan)
+            st.success("Queued: every planned flight goes in as one batched import.")
 
 # -----------------------------------------------------
-# TIME HELPERS
+# PRICE HISTORY
 # -----------------------------------------------------
-def parse_dt(s):
-    return TZ.localize(datetime.strptime(s, "%Y-%m-%d %H:%M"))
+def show_price_change(route, flight):
+    change = price_watch.price_change(route, flight)
+    if change and change[1] < change[0]:
+        st.success(f"⬇️ ${change[0] - change[1]} cheaper than when first seen (${change[0]})")
+    elif change and change[1] > change[0]:
+        st.caption(f"⬆️ up ${change[1] - change[0]} since first seen (${change[0]})")
 
 # -----------------------------------------------------
-# CALENDAR ACTIVITY CONSTRAINTS
+# DEBUG PANEL
 # -----------------------------------------------------
-def get_day_constraints(service, date_obj):
-    # print("DEBUG calendar:", TRAVEL_CAL_ID)
-    # print("DEBUG date:", date_obj)
-
-    start = TZ.localize(datetime(date_obj.year, date_obj.month, date_obj.day, 0, 0))
-    end = TZ.localize(datetime(date_obj.year, date_obj.month, date_obj.day, 23, 59))
-
-    events = service.events().list(
-        calendarId=TRAVEL_CAL_ID,
-        timeMin=start.isoformat(),
-        timeMax=end.isoformat(),
-        singleEvents=True
-    ).execute().get("items", [])
-
-    starts, ends = [], []
+def render_debug_panel():
+    with st.expander("🔧 Debug: performance"):
+        run = metrics.run_snapshot()
+        totals = metrics.totals_snapshot()
+        rate = metrics.cache_hit_rate()
+
+        st.write("**This rerun (ms)**")
+        st.json(run["phases_ms"])
+        st.write("**API calls this rerun**")
+        st.json(run["counters"])
+        st.write(f"**Flight cache hit rate:** {'n/a' if rate is None else f'{rate:.0%}'}")
+        st.write(f"**Calendar writes queued:** {calendar_writer.depth()}")
+        store = planner.STORE.stats()
+        rss = itinerary_store.rss_bytes()
+        st.write(
+            f"**Memory:** {'n/a' if rss is None else f'{rss / 2**20:.0f} MB'} RSS · itinerary store "
+            f"{store['bytes'] / 2**20:.2f} of {store['budget_bytes'] / 2**20:.0f} MB "
+            f"({store['entries']} entries, {store['active_sessions']} active sessions)"
+        )
+        st.write("**Since process start**")
+        st.json(totals)
+        if planner.METRICS_PORT:
+            st.caption(f"Prometheus text at http://127.0.0.1:{planner.METRICS_PORT}/metrics")
 
-    for ev in events:
-        # Skip ALL flight preview events (outbound or inbound)
-        private = ev.get("extendedProperties", {}).get("private", {})
-        if "flight_preview" in private:
-            continue
-
-        if "dateTime" in ev["start"]:
-            starts.append(datetime.fromisoformat(ev["start"]["dateTime"]))
-        if "dateTime" in ev["end"]:
-            ends.append(datetime.fromisoformat(ev["end"]["dateTime"]))
-
-    return (min(starts) if starts else None), (max(ends) if ends else None)
-
-
-# -----------------------------------------------------
-# FILTERS
 # -----------------------------------------------------
-def filter_arrival_flights(flights, latest_allowed):
-    if latest_allowed is None:
-        return flights
-    return [
-        f for f in flights
-        if parse_dt(f["segments"][-1]["arr_time"]) <= latest_allowed
-    ]
-
-def filter_departure_flights(flights, earliest_allowed):
-    if earliest_allowed is None:
-        return flights
-    return [
-        f for f in flights
-        if parse_dt(f["segments"][0]["dep_time"]) >= earliest_allowed
-    ]
-
-# -----------------------------------------------------
-# CALENDAR PREVIEWS
-# -----------------------------------------------------
-def clear_previews(service, tag):
-    evs = service.events().list(
-        calendarId=TRAVEL_CAL_ID,
-        privateExtendedProperty=f"flight_preview={tag}"
-    ).execute().get("items", [])
-
-    for e in evs:
-        service.events().delete(calendarId=TRAVEL_CAL_ID, eventId=e["id"]).execute()
-
-def add_preview(service, flight, tag, color):
-    for seg in flight["segments"]:
-        service.events().insert(
-            calendarId=TRAVEL_CAL_ID,
-            body={
-                "summary": f"{seg['dep']} → {seg['arr']} (${flight['price']}, {seg['airline']})",
-                "start": {"dateTime": parse_dt(seg["dep_time"]).isoformat()},
-                "end": {"dateTime": parse_dt(seg["arr_time"]).isoformat()},
-                "colorId": color,
-                "extendedProperties": {"private": {"flight_preview": tag}},
-            }
-        ).execute()
-
-# -----------------------------------------------------
-# TRIP BLOCK
+# STREAMLIT APP
 # -----------------------------------------------------
-def create_trip_block(service):
-    existing = service.events().list(
-        calendarId=TRAVEL_CAL_ID,
-        privateExtendedProperty="trip_block=yes"
-    ).execute().get("items", [])
-
-    if existing:
+def show_leg(title, flights, pareto, state, idx_name, key_name, route_key, tag, color):
+    st.subheader(title)
+    if not flights:
+        st.error(f"No {title.lower()} flights available")
         return
 
-    end = (datetime.strptime(RETURN_DATE, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    shown = state[idx_name]
+    f = flights[shown]
+    state[key_name] = f["key"]
+    st.write(f"**${f['price']}**" + (" ⭐ Pareto-optimal" if pareto[shown] else ""))
+    st.caption(f"Option {shown + 1} of {len(flights)} · {sum(pareto)} non-dominated")
+    show_price_change(route_key, f)
+    for s in f["segments"]:
+        st.write(f"{s['dep']} → {s['arr']} ({s['dep_time']} → {s['arr_time']}) {s['flight_number'] or ''}")
+    if f.layovers:
+        st.caption(f"Layovers: {planner.layover_summary(f)}")
+
+    if st.button(f"⬅️ {title}"):
+        state[idx_name] -= 1
+    if st.button(f"➡️ {title}"):
+        state[idx_name] += 1
+
+    with metrics.timed("queue_preview"):
+        planner.queue_preview(flights, shown, tag, color)
+
+LEG_COLORS = ("9", "10", "11", "5", "6", "7")
+
+def show_multi_city(service, state):
+    routes = [route for _, route in planner.leg_routes()]
+    if planner.cache_updated(state["fetched_at"], routes):
+        planner.store_flights(state, *planner.load_flights())
+
+    rules = sidebar_connection_rules()
+    objective = st.sidebar.selectbox("Optimise for", list(multi_city.OBJECTIVES))
+    overlay = sidebar_what_if(service, state)
+    paths = planner.plan_multi_city(service, state, rules, objective, overlay)
+
+    st.subheader(" → ".join(planner.ROUTE))
+    if not paths:
+        st.error("No combination of flights fits your calendar")
+    else:
+        shown = state["idx"]
+        _, path = paths[shown]
+        hours = sum(f.total_duration or 0 for f in path) // 60
+        st.write(f"**${sum(f.price or 0 for f in path)}** · {hours}h flying")
+        st.caption(f"Itinerary {shown + 1} of {len(paths)}, best first")
+
+        for i, (col, f) in enumerate(zip(st.columns(len(path)), path)):
+            with col:
+                st.write(f"**{planner.ROUTE[i]} → {planner.ROUTE[i + 1]}** · ${f['price']}")
+                for s in f["segments"]:
+                    st.write(f"{s['dep']} → {s['arr']} ({s['dep_time']} → {s['arr_time']}) {s['flight_number'] or ''}")
+                if f.layovers:
+                    st.caption(f"Layovers: {planner.layover_summary(f)}")
+            with metrics.timed("queue_preview"):
+                planner.queue_preview([f], 0, f"leg{i + 1}", LEG_COLORS[i % len(LEG_COLORS)])
+
+        if st.button("⬅️ Itinerary"):
+            state["idx"] -= 1
+        if st.button("➡️ Itinerary"):
+            state["idx"] += 1
+        show_export([(f"{planner.ROUTE[i]} → {planner.ROUTE[i + 1]}", f) for i, f in enumerate(path)])
+
+    if overlay:
+        st.info("What-if mode: itineraries reflect your unsaved calendar edits.")
+    st.caption("Calendar constraints re-evaluated on every interaction.")
+    fetched = datetime.fromtimestamp(min(state["fetched_at"].values()))
+    st.caption(f"Fares as of {fetched:%Y-%m-%d %H:%M}.")
 
-    service.events().insert(
-        calendarId=TRAVEL_CAL_ID,
-        body={
-            "summary": TRIP_NAME,
-            "start": {"date": DEPART_DATE},
-            "end": {"date": end},
-            "colorId": "5",
-            "extendedProperties": {"private": {"trip_block": "yes"}},
-        }
-    ).execute()
+    render_debug_panel()
+
+    if flight_sources.pending(planner.FLIGHT_PROVIDERS, routes):
+        st.caption("⏳ Searching for more flights…")
+        time.sleep(1)
+        st.rerun()
 
-# -----------------------------------------------------
-# STREAMLIT APP
-# -----------------------------------------------------
 def main():
 
     if "last_refresh" not in st.session_state:
@@ -227,98 +232,79 @@ def main():
     st.set_page_config(page_title="Flight Planner", layout="wide")
     st.title("✈️ Calendar-Aware Flight Planner")
 
-    service = get_calendar_service()
+    metrics.begin_run()
+    if planner.METRICS_PORT:
+        metrics.start_server(planner.METRICS_PORT)
+
+    with metrics.timed("get_calendar_service"):
+        service = planner.get_calendar_service()
+    planner.start_calendar_writer()
 
     # ---------- Load data ----------
     if "state" not in st.session_state:
-        if os.path.exists(JSON_FILE):
-            with open(JSON_FILE) as f:
-                raw = json.load(f)
-            out_raw = raw["outbound_raw"]
-            in_raw = raw["inbound_raw"]
-        else:
-            out_raw = fetch_one_way(ORIGIN, DEST, DEPART_DATE)
-            in_raw = fetch_one_way(DEST, ORIGIN, RETURN_DATE)
-            with open(JSON_FILE, "w") as f:
-                json.dump({"outbound_raw": out_raw, "inbound_raw": in_raw}, f, indent=2)
-
-        outbound = extract_flights(out_raw)
-        inbound = extract_flights(in_raw)
-
-        st.session_state.state = {
-            "all_out": outbound,
-            "all_in": inbound,
-            "idx_out": 0,
-            "idx_in": 0,
-        }
-
-        create_trip_block(service)
+        st.session_state.state = planner.new_state()
 
     state = st.session_state.state
+    # Keeps this tab's itineraries in the shared store while it is in use.
+    planner.STORE.touch(get_script_run_ctx().session_id, state["flights"])
 
-    # ---------- Apply constraints ----------
-    out_date = parse_dt(state["all_out"][0]["segments"][-1]["arr_time"]).date()
-    in_date = parse_dt(state["all_in"][0]["segments"][0]["dep_time"]).date()
-
-    out_earliest_start, _ = get_day_constraints(service, out_date)
-    _, in_latest_end = get_day_constraints(service, in_date)
+    if planner.MULTI_CITY:
+        show_multi_city(service, state)
+        return
 
-    # print(out_earliest_start)
+    # ---------- Background fare refresh ----------
+    if planner.PRICE_REFRESH and not planner.ROUND_TRIP:
+        price_watch.watch(*planner.OUT_ROUTE)
+        price_watch.watch(*planner.IN_ROUTE)
+        price_watch.start(planner.fetch_one_way, planner.extract_flights)
 
-    valid_out = filter_arrival_flights(
-        state["all_out"],
-        out_earliest_start
-    )
+    reloaded = not planner.ROUND_TRIP and planner.cache_updated(state["fetched_at"])
+    if reloaded:
+        planner.store_flights(state, *planner.load_flights())
 
-    valid_in = filter_departure_flights(
-        state["all_in"],
-        in_latest_end
+    # ---------- Apply constraints ----------
+    rules = sidebar_connection_rules()
+    rank_weights = ranking.PRESETS[st.sidebar.selectbox("Rank options by", list(ranking.PRESETS))]
+    overlay = sidebar_what_if(service, state)
+    valid_out, pareto_out, valid_in, pareto_in = planner.plan_options(
+        service, state, rules, rank_weights, reloaded,
+        waiting=lambda: st.spinner("Loading return flights…"), overlay=overlay,
     )
 
-
-    state["idx_out"] %= max(1, len(valid_out))
-    state["idx_in"] %= max(1, len(valid_in))
+    # ---------- What-if comparison ----------
+    if overlay:
+        with metrics.timed("what_if"):
+            actual_out, _, actual_in, _ = planner.plan_options(service, dict(state), rules, rank_weights)
+        st.info("What-if mode: options below reflect your unsaved calendar edits.")
+        with st.expander("Changes vs. your real calendar", expanded=True):
+            show_changes("Outbound", *planner.option_changes(actual_out, valid_out))
+            show_changes("Inbound", *planner.option_changes(actual_in, valid_in))
 
     # ---------- UI ----------
     col1, col2 = st.columns(2)
 
     with col1:
-        st.subheader("Outbound")
-        if valid_out:
-            f = valid_out[state["idx_out"]]
-            st.write(f"**${f['price']}**")
-            for s in f["segments"]:
-                st.write(f"{s['dep']} → {s['arr']} ({s['dep_time']} → {s['arr_time']})")
-
-            if st.button("⬅️ Outbound"):
-                state["idx_out"] -= 1
-            if st.button("➡️ Outbound"):
-                state["idx_out"] += 1
-
-            clear_previews(service, "outbound")
-            add_preview(service, f, "outbound", "9")
-        else:
-            st.error("No outbound flights available")
+        show_leg("Outbound", valid_out, pareto_out, state, "idx_out", "key_out", planner.OUT_KEY, "outbound", "9")
 
     with col2:
-        st.subheader("Inbound")
-        if valid_in:
-            f = valid_in[state["idx_in"]]
-            st.write(f"**${f['price']}**")
-            for s in f["segments"]:
-                st.write(f"{s['dep']} → {s['arr']} ({s['dep_time']} → {s['arr_time']})")
-
-            if st.button("⬅️ Inbound"):
-                state["idx_in"] -= 1
-            if st.button("➡️ Inbound"):
-                state["idx_in"] += 1
-
-            clear_previews(service, "inbound")
-            add_preview(service, f, "inbound", "10")
-        else:
-            st.error("No inbound flights available")
+        show_leg("Inbound", valid_in, pareto_in, state, "idx_in", "key_in", planner.IN_KEY, "inbound", "10")
+
+    if valid_out and valid_in:
+        show_export([("Outbound", valid_out[state["idx_out"]]), ("Inbound", valid_in[state["idx_in"]])])
 
     st.caption("Calendar constraints re-evaluated on every interaction.")
+    if planner.ROUND_TRIP:
+        st.caption("Round-trip mode: prices are round-trip totals for the selected pair.")
+    fetched = datetime.fromtimestamp(min(state["fetched_at"].values()))
+    st.caption(f"Fares as of {fetched:%Y-%m-%d %H:%M}.")
+
+    render_debug_panel()
+
+    # ---------- Progressive results ----------
+    if flight_sources.pending(planner.FLIGHT_PROVIDERS, [planner.OUT_ROUTE, planner.IN_ROUTE]):
+        st.caption("⏳ Searching for more flights…")
+        time.sleep(1)
+        st.rerun()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,696 @@
+# ============================================
+# Filename: planner.py
+# Purpose: Flight planning engine using SerpAPI + Google Calendar
+# Shared by the Streamlit app (plan_trip.py) and the terminal planner
+# (plan_cli.py); nothing here imports Streamlit.
+# ============================================
+
+import hashlib
+import os
+import uuid
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+import pytz
+import requests
+
+import httplib2
+from google.oauth2.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+from googleapiclient.discovery import build
+from googleapiclient.http import set_user_agent
+
+import calendar_constraints
+import calendar_list
+import calendar_writer
+import fake_calendar
+import flight_cache
+import flight_sources
+import itinerary
+import itinerary_store
+import metrics
+import multi_city
+import price_watch
+import ranking
+import trip_export
+import trip_registry
+
+
+# -----------------------------------------------------
+# CONFIG
+# -----------------------------------------------------
+API_KEY = os.getenv("SERPAPI_KEY")
+if not API_KEY:
+    raise ValueError("API_KEY is not set. Please set SERPAPI_KEY.")
+
+ORIGIN = "IAH"
+DEST = "GUA"
+
+# PLANNER_NEARBY=1 searches every airport of a metro area (IAH also finds
+# flights from HOU). PLANNER_METROS replaces the areas, e.g. "IAH+HOU,JFK+LGA+EWR".
+NEARBY = os.getenv("PLANNER_NEARBY", "0") == "1"
+METRO_AIRPORTS = {
+    airport.strip(): tuple(a.strip() for a in group.strip().split("+"))
+    for group in os.getenv(
+        "PLANNER_METROS", "IAH+HOU,DFW+DAL,JFK+LGA+EWR,ORD+MDW,LAX+BUR+LGB+SNA+ONT,SFO+OAK+SJC,MIA+FLL,IAD+DCA+BWI"
+    ).upper().split(",") if group.strip()
+    for airport in group.strip().split("+")
+}
+
+def search_airports(code):
+    """departure_id/arrival_id for an airport: its whole metro area when NEARBY."""
+    return ",".join(METRO_AIRPORTS.get(code, (code,))) if NEARBY else code
+
+DEPART_DATE = "2026-01-22"
+RETURN_DATE = "2026-01-25"
+
+TRIP_NAME = "Texas → Guatemala Trip"
+# Identifies this trip's block in trip_registry.json; changing the dates moves it
+TRIP_ID = f"{ORIGIN}-{DEST}:{TRIP_NAME}"
+# Trip files from older versions; imported into flight_cache/ on first run
+JSON_FILE = f"flights_{ORIGIN}_{DEST}_{DEPART_DATE}_{RETURN_DATE}.json"
+
+OUT_ROUTE = (search_airports(ORIGIN), search_airports(DEST), DEPART_DATE)
+IN_ROUTE = (search_airports(DEST), search_airports(ORIGIN), RETURN_DATE)
+OUT_KEY = flight_cache.route_key(*OUT_ROUTE)
+IN_KEY = flight_cache.route_key(*IN_ROUTE)
+
+# Comma-separated providers queried in parallel for every leg: serpapi,
+# serpapi_fast (quick non-deep first pass), amadeus
+FLIGHT_PROVIDERS = os.getenv("PLANNER_PROVIDERS", "serpapi_fast,serpapi").split(",")
+AMADEUS_CLIENT_ID = os.getenv("AMADEUS_CLIENT_ID")
+AMADEUS_CLIENT_SECRET = os.getenv("AMADEUS_CLIENT_SECRET")
+PROVIDER_TIMEOUT = float(os.getenv("PLANNER_PROVIDER_TIMEOUT", "0")) or None
+# Render once each leg has this many itineraries; slower providers (e.g. the
+# deep search) are merged in place on a later rerun when they finish
+ADEQUATE_RESULTS = int(os.getenv("PLANNER_ADEQUATE_RESULTS", "1"))
+
+# "round_trip" prices both legs together (SerpAPI type=1): return options are
+# fetched per selected outbound via its departure_token, prefetching the first
+# RETURN_PREFETCH outbounds and the neighbours of the current one
+TRIP_MODE = os.getenv("PLANNER_TRIP_MODE", "one_way")
+ROUND_TRIP = TRIP_MODE == "round_trip"
+RT_ROUTE = (search_airports(ORIGIN), search_airports(DEST), f"{DEPART_DATE}_{RETURN_DATE}")
+RETURN_PREFETCH = int(os.getenv("PLANNER_RETURN_PREFETCH", "3"))
+
+# "multi_city" plans a whole route such as IAH,GUA,SJO,IAH with one date per
+# leg. Each date may slide by ±PLANNER_DATE_FLEX days, and you stay at least
+# PLANNER_MIN_STAY_HOURS in every city along the way.
+MULTI_CITY = TRIP_MODE == "multi_city"
+ROUTE = os.getenv("PLANNER_ROUTE", f"{ORIGIN},{DEST},{ORIGIN}").split(",")
+ROUTE_DATES = os.getenv("PLANNER_ROUTE_DATES", f"{DEPART_DATE},{RETURN_DATE}").split(",")
+if MULTI_CITY and len(ROUTE_DATES) != len(ROUTE) - 1:
+    raise ValueError("PLANNER_ROUTE_DATES needs one date per leg of PLANNER_ROUTE")
+DATE_FLEX = int(os.getenv("PLANNER_DATE_FLEX", "0"))
+MIN_STAY_HOURS = float(os.getenv("PLANNER_MIN_STAY_HOURS", "12"))
+
+# Connection rules: default minimum connection time (minutes, 0 = keep every
+# connection the search offers), per-airport overrides as "MIA=90,JFK=120",
+# and the longest acceptable layover in hours (0 = any).
+# The UI can tighten these per session.
+MIN_CONNECTION = int(os.getenv("PLANNER_MIN_CONNECTION", "0"))
+AIRPORT_MIN_CONNECTION = tuple(
+    (airport.strip().upper(), int(minutes))
+    for airport, _, minutes in (
+        item.partition("=") for item in os.getenv("PLANNER_AIRPORT_MCT", "").split(",") if item.strip()
+    )
+)
+MAX_LAYOVER_HOURS = int(os.getenv("PLANNER_MAX_LAYOVER_HOURS", "0"))
+
+# Re-fetch watched routes in the background (see price_watch.REFRESH_SCHEDULE)
+PRICE_REFRESH = os.getenv("PLANNER_PRICE_REFRESH", "1") == "1"
+
+SCOPES = [
+    "https://www.googleapis.com/auth/calendar",
+    "https://www.googleapis.com/auth/calendar.events",
+]
+
+with open("travel_calendar_id.txt", "r") as f:
+    TRAVEL_CAL_ID = f.read().strip()
+
+TZ = pytz.timezone("America/Chicago")
+
+# How all-day calendar events constrain flights: ignore, workday (busy during
+# PLANNER_ALL_DAY_HOURS, e.g. "9-17") or block (busy all day)
+ALL_DAY_MODE = os.getenv("PLANNER_ALL_DAY", "ignore")
+if ALL_DAY_MODE not in calendar_constraints.ALL_DAY_MODES:
+    raise ValueError(f"PLANNER_ALL_DAY must be one of {', '.join(calendar_constraints.ALL_DAY_MODES)}")
+ALL_DAY_HOURS = tuple(int(h) for h in os.getenv("PLANNER_ALL_DAY_HOURS", "9-17").split("-"))
+
+# Process-wide mirror of the travel calendar shared by every session
+EVENTS = calendar_constraints.EventCache(TRAVEL_CAL_ID, TZ)
+
+# Parsed itineraries live in one process-wide store; sessions hold handles.
+# The store stays under PLANNER_STORE_MB, and sessions idle for
+# PLANNER_SESSION_IDLE_MINUTES stop keeping their entries in it.
+STORE = itinerary_store.ItineraryStore(
+    int(float(os.getenv("PLANNER_STORE_MB", "256")) * 2**20),
+    float(os.getenv("PLANNER_SESSION_IDLE_MINUTES", "30")) * 60,
+)
+
+# PLANNER_CALENDAR=fake swaps Google for an in-memory calendar (load testing),
+# optionally seeded from a fake_calendar fixture and slowed by a per-call latency.
+CALENDAR_BACKEND = os.getenv("PLANNER_CALENDAR", "google")
+FAKE_CALENDAR_FIXTURE = os.getenv("PLANNER_CALENDAR_FIXTURE")
+FAKE_CALENDAR_LATENCY = float(os.getenv("PLANNER_FAKE_LATENCY", "0"))
+
+# Set to serve Prometheus text at http://127.0.0.1:<port>/metrics
+METRICS_PORT = int(os.getenv("PLANNER_METRICS_PORT", "0"))
+
+# -----------------------------------------------------
+# GOOGLE CALENDAR AUTH
+# -----------------------------------------------------
+def get_calendar_service():
+    if CALENDAR_BACKEND == "fake":
+        return fake_calendar.shared_service(
+            FAKE_CALENDAR_FIXTURE, tz=TZ, latency=FAKE_CALENDAR_LATENCY
+        )
+
+    creds = None
+    if os.path.exists("token.json"):
+        creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+
+    if not creds or not creds.valid:
+        # Only needed for the first login; importing it costs ~0.3 s of startup.
+        from google_auth_oauthlib.flow import InstalledAppFlow
+        flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
+        creds = flow.run_local_server(port=0)
+        with open("token.json", "w") as t:
+            t.write(creds.to_json())
+
+    # Google only gzips responses for clients whose user agent says "gzip".
+    http = set_user_agent(AuthorizedHttp(creds, http=httplib2.Http()), "flight-planner (gzip)")
+    return build("calendar", "v3", http=http)
+
+# -----------------------------------------------------
+# SERPAPI
+# -----------------------------------------------------
+def fetch_one_way(origin, dest, date, deep=True):
+    url = "https://serpapi.com/search"
+    params = {
+        "engine": "google_flights",
+        "api_key": API_KEY,
+        "departure_id": origin,
+        "arrival_id": dest,
+        "outbound_date": date,
+        "type": "2",
+    }
+    if deep:
+        params["deep_search"] = "true"
+    metrics.inc("serpapi_calls", deep=str(deep).lower())
+    return requests.get(url, params=params).json()
+
+def fetch_round_trip(origin, dest, depart_date, return_date, departure_token=None, deep=True):
+    """Outbound options of a round trip, or the returns for one outbound's departure_token."""
+    url = "https://serpapi.com/search"
+    params = {
+        "engine": "google_flights",
+        "api_key": API_KEY,
+        "departure_id": origin,
+        "arrival_id": dest,
+        "outbound_date": depart_date,
+        "return_date": return_date,
+        "type": "1",
+    }
+    if departure_token:
+        params["departure_token"] = departure_token
+    if deep:
+        params["deep_search"] = "true"
+    metrics.inc("serpapi_calls", deep=str(deep).lower())
+    return requests.get(url, params=params).json()
+
+# -----------------------------------------------------
+# FLIGHT DATA
+# -----------------------------------------------------
+def get_providers():
+    return flight_sources.make_providers(
+        FLIGHT_PROVIDERS, fetch_one_way, AMADEUS_CLIENT_ID, AMADEUS_CLIENT_SECRET, PROVIDER_TIMEOUT
+    )
+
+def load_trip():
+    """Both legs from every provider (cached, fetched on a miss) + when each was fetched."""
+    parsed, fetched_at = flight_sources.search_routes(
+        get_providers(), [OUT_ROUTE, IN_ROUTE], extract_flights, adequate=ADEQUATE_RESULTS
+    )
+
+    outbound = dedup_flights(*parsed[OUT_ROUTE])
+    inbound = dedup_flights(*parsed[IN_ROUTE])
+    for key, route, flights in ((OUT_KEY, OUT_ROUTE, outbound), (IN_KEY, IN_ROUTE, inbound)):
+        stamps = [fetched_at[k] for k in flight_sources.cache_keys(FLIGHT_PROVIDERS, [route]) if k in fetched_at]
+        if stamps:
+            price_watch.observe(key, max(stamps), flights)
+
+    return outbound, inbound, fetched_at
+
+def load_round_trip():
+    """Round-trip outbound options; inbound is filled per selected outbound."""
+    entry = flight_cache.get_route(
+        *RT_ROUTE,
+        lambda o, d, _: fetch_round_trip(o, d, DEPART_DATE, RETURN_DATE),
+        source="serpapi_rt",
+    )
+    outbound = dedup_flights(extract_flights(entry["raw"]))
+    return outbound, [], {flight_cache.route_key(*RT_ROUTE, source="serpapi_rt"): entry["fetched_at"]}
+
+def returns_route(flight):
+    """Cache route of one outbound's return options (keyed by its departure_token)."""
+    origin, dest, _ = RT_ROUTE
+    return (dest, origin, f"{RETURN_DATE}_{hashlib.sha1(flight['departure_token'].encode()).hexdigest()[:16]}")
+
+def fetch_returns(flight):
+    """Future for one outbound's return options, cached per departure_token."""
+    token = flight["departure_token"]
+    origin, dest, _ = RT_ROUTE
+    return flight_sources.submit(
+        returns_route(flight),
+        lambda o, d, _: fetch_round_trip(origin, dest, DEPART_DATE, RETURN_DATE, departure_token=token),
+        "serpapi_rt",
+    )
+
+def round_trip_returns(valid_out, idx):
+    if not valid_out:
+        return []
+    # Warm the cache for the likely next picks; only the selected one is waited on.
+    # Cached ones are left alone, so reruns don't re-read their files.
+    n = len(valid_out)
+    for i in list(range(min(RETURN_PREFETCH, n))) + [(idx - 1) % n, (idx + 1) % n]:
+        f = valid_out[i]
+        if f.get("departure_token") and flight_cache.fetched_at(
+                flight_cache.route_key(*returns_route(f), source="serpapi_rt")) is None:
+            fetch_returns(f)
+
+    selected = valid_out[idx]
+    if not selected.get("departure_token"):
+        return []
+    key = flight_cache.route_key(*returns_route(selected), source="serpapi_rt")
+    entry = None
+    if flight_cache.fetched_at(key) is None:
+        entry = fetch_returns(selected).result()
+
+    # Parsed once per cached answer and shared through the store, not on every rerun.
+    def parse():
+        raw = (entry or fetch_returns(selected).result())["raw"]
+        return dedup_flights(extract_flights(raw))
+    return STORE.get(("returns", key, flight_cache.fetched_at(key)), parse)
+
+def cache_updated(fetched_at, routes=(OUT_ROUTE, IN_ROUTE)):
+    # Also true when a provider we stopped waiting for has since answered.
+    for key in flight_sources.cache_keys(FLIGHT_PROVIDERS, routes):
+        current = flight_cache.fetched_at(key)
+        if current is not None and (key not in fetched_at or abs(current - fetched_at[key]) > 1e-3):
+            return True
+    return False
+
+# -----------------------------------------------------
+# MULTI-CITY
+# -----------------------------------------------------
+def leg_routes():
+    """[(leg index, (origin, dest, date))] for every leg and every candidate date."""
+    routes = []
+    for leg, (origin, dest, date) in enumerate(zip(ROUTE, ROUTE[1:], ROUTE_DATES)):
+        day = datetime.strptime(date, "%Y-%m-%d")
+        for shift in range(-DATE_FLEX, DATE_FLEX + 1):
+            routes.append((leg, (search_airports(origin), search_airports(dest),
+                                 (day + timedelta(days=shift)).strftime("%Y-%m-%d"))))
+    return routes
+
+def load_multi_city():
+    """Options per leg (all candidate dates, fetched concurrently) + when each was fetched."""
+    routes = leg_routes()
+    parsed, fetched_at = flight_sources.search_routes(
+        get_providers(), [route for _, route in routes], extract_flights, adequate=ADEQUATE_RESULTS
+    )
+    legs = []
+    for leg in range(len(ROUTE) - 1):
+        legs.append(dedup_flights(*[f for l, route in routes if l == leg for f in parsed[route]]))
+    return legs, fetched_at
+
+def leg_options(service, flights, first, last, rules, overlay=None):
+    """A leg's options that fit the calendar.
+
+    Like the two-leg trip: arrive before the first activity of the arrival day
+    (unless coming home) and leave after the last one of the departure day
+    (unless leaving home).
+    """
+    bounds = {}
+
+    def day_bounds(minutes):
+        day = datetime.fromordinal(minutes // 1440).date()
+        if day not in bounds:
+            earliest, latest = get_day_constraints(service, day, overlay)
+            bounds[day] = (local_minutes(earliest) if earliest else None,
+                           local_minutes(latest) if latest else None)
+        return bounds[day]
+
+    keep = []
+    for f in filter_flights(flights, rules):
+        if not last:
+            earliest = day_bounds(f.arr_min)[0]
+            if earliest is not None and f.arr_min > earliest:
+                continue
+        if not first:
+            latest = day_bounds(f.dep_min)[1]
+            if latest is not None and f.dep_min < latest:
+                continue
+        keep.append(f)
+    return keep
+
+def plan_multi_city(service, state, rules, objective, overlay=None):
+    """Best whole-route paths [(cost, (flight per leg))], best first."""
+    legs = session_flights(state)
+    with metrics.timed("filter"):
+        options = [leg_options(service, flights, i == 0, i == len(legs) - 1, rules, overlay)
+                   for i, flights in enumerate(legs)]
+    with metrics.timed("route_search"):
+        paths = multi_city.best_paths(options, objective, int(MIN_STAY_HOURS * 60))
+    state["idx"] %= max(1, len(paths))
+    return paths
+
+# -----------------------------------------------------
+# PARSER
+# -----------------------------------------------------
+def itinerary_key(block):
+    # Same flight numbers at the same times = same itinerary, whichever list
+    # (best/other) or search it came from.
+    return "|".join(
+        f"{(seg.get('flight_number') or seg.get('airline', '?')).replace(' ', '').upper()}"
+        f"@{seg['departure_airport']['time']}>{seg['arrival_airport']['time']}"
+        for seg in block.get("flights", [])
+    )
+
+def extract_flights(raw):
+    return [
+        itinerary.Itinerary(flight_id, itinerary_key(block), block)
+        for flight_id, block in enumerate(raw.get("best_flights", []) + raw.get("other_flights", []))
+    ]
+
+def index_of_key(flights, key, default):
+    for i, f in enumerate(flights):
+        if f["key"] == key:
+            return i
+    return default
+
+def dedup_flights(*flight_lists):
+    """Merge itinerary lists, keeping the cheapest copy of each itinerary key."""
+    unique = {}
+    total = 0
+    for flights in flight_lists:
+        for f in flights:
+            total += 1
+            seen = unique.get(f.key)
+            if seen is None or (f.price is not None and (seen.price is None or f.price < seen.price)):
+                unique[f.key] = f
+    metrics.inc("itineraries_deduped", total - len(unique))
+    return list(unique.values())
+
+# -----------------------------------------------------
+# TIME HELPERS
+# -----------------------------------------------------
+def parse_dt(s):
+    return TZ.localize(datetime.strptime(s, "%Y-%m-%d %H:%M"))
+
+def local_minutes(dt):
+    # Flight times are wall-clock in TZ; compare bounds on the same clock.
+    return itinerary.datetime_minutes(dt.astimezone(TZ))
+
+# -----------------------------------------------------
+# CALENDAR ACTIVITY CONSTRAINTS
+# -----------------------------------------------------
+def get_day_constraints(service, date_obj, overlay=None):
+    """(earliest activity start, latest activity end) on a day, from the synced event cache."""
+    EVENTS.sync(service)
+    return EVENTS.day_bounds(date_obj, ALL_DAY_MODE, ALL_DAY_HOURS, overlay)
+
+# -----------------------------------------------------
+# WHAT-IF EDITS
+# -----------------------------------------------------
+# A what-if overlay is {event id: event} laid over the synced calendar: moved
+# copies of real events and "whatif-<random>" additions. Only apply_edits writes it.
+def moved_event(ev, minutes):
+    shift = timedelta(minutes=minutes)
+    moved = dict(ev)
+    for end in ("start", "end"):
+        value = dict(ev[end])
+        value["dateTime"] = (datetime.fromisoformat(value["dateTime"]) + shift).isoformat()
+        moved[end] = value
+    return moved
+
+def new_activity(summary, start, end):
+    # Unique even across restarts: the id is also the coalesce key of its
+    # journaled insert, which must never be replaced by a later activity.
+    event_id = f"whatif-{uuid.uuid4().hex[:12]}"
+    return event_id, {
+        "id": event_id,
+        "summary": summary,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": end.isoformat()},
+    }
+
+def apply_edit(service, payload):
+    body = {k: payload["event"][k] for k in ("summary", "start", "end")}
+    if payload["event"]["id"].startswith("whatif-"):
+        metrics.inc("calendar_calls", op="insert")
+        service.events().insert(calendarId=TRAVEL_CAL_ID, body=body).execute()
+    else:
+        metrics.inc("calendar_calls", op="patch")
+        service.events().patch(calendarId=TRAVEL_CAL_ID, eventId=payload["event"]["id"], body=body).execute()
+
+def apply_edits(overlay):
+    """Write a what-if overlay to the real calendar (in the background)."""
+    for event_id, ev in overlay.items():
+        calendar_writer.enqueue(f"what_if:{event_id}", "apply_edit", {"event": ev})
+
+def option_changes(before, after):
+    """(options only in after, options only in before), compared by itinerary key."""
+    before_keys = {f.key for f in before}
+    after_keys = {f.key for f in after}
+    return [f for f in after if f.key not in before_keys], [f for f in before if f.key not in after_keys]
+
+
+# -----------------------------------------------------
+# FILTERS
+# -----------------------------------------------------
+def filter_flights(flights, rules=None, latest_arrival=None, earliest_departure=None):
+    """One pass over the list: calendar bounds plus connection rules."""
+    latest = local_minutes(latest_arrival) if latest_arrival is not None else None
+    earliest = local_minutes(earliest_departure) if earliest_departure is not None else None
+    return [
+        f for f in flights
+        if (latest is None or f.arr_min <= latest)
+        and (earliest is None or f.dep_min >= earliest)
+        and (rules is None or rules.allows(f))
+    ]
+
+def filter_arrival_flights(flights, latest_allowed, rules=None):
+    return filter_flights(flights, rules, latest_arrival=latest_allowed)
+
+def filter_departure_flights(flights, earliest_allowed, rules=None):
+    return filter_flights(flights, rules, earliest_departure=earliest_allowed)
+
+def layover_summary(flight):
+    return " · ".join(
+        f"{m // 60}h{m % 60:02d} at {itinerary.AIRPORTS.text(code)}" + (" (overnight)" if overnight else "")
+        for code, m, overnight in flight.layovers
+    )
+
+# -----------------------------------------------------
+# RANKING
+# -----------------------------------------------------
+def rank_flights(flights, bound, weights, arrival):
+    """Pareto-first ranking; slack is the gap to the day's first/last activity."""
+    slack = None
+    if bound is not None:
+        b = local_minutes(bound)
+        if arrival:
+            slack = [b - f.arr_min for f in flights]
+        else:
+            slack = [f.dep_min - b for f in flights]
+    return ranking.rank(flights, slack, weights)
+
+# -----------------------------------------------------
+# CALENDAR PREVIEWS
+# -----------------------------------------------------
+# What sync_preview compares to decide whether a preview event can stay
+PREVIEW_FIELDS = "id,summary,start,end,colorId"
+
+def _preview_signature(ev):
+    return ev.get("summary"), ev["start"].get("dateTime"), ev["end"].get("dateTime"), ev.get("colorId")
+
+def preview_bodies(flight, tag, color):
+    return [
+        {
+            "summary": f"{seg['dep']} → {seg['arr']} (${flight['price']}, {seg['airline']})",
+            "start": {"dateTime": parse_dt(seg["dep_time"]).isoformat()},
+            "end": {"dateTime": parse_dt(seg["arr_time"]).isoformat()},
+            "colorId": color,
+            "extendedProperties": {"private": {"flight_preview": tag}},
+        }
+        for seg in flight["segments"]
+    ]
+
+def sync_preview(service, tag, bodies):
+    """Make preview `tag` exactly these events.
+
+    One list, then one batch with only the deletes and inserts that differ:
+    segments already on the calendar (e.g. shared by the previous pick) stay.
+    """
+    wanted = {}
+    for body in bodies:
+        wanted.setdefault(_preview_signature(body), []).append(body)
+    requests = []
+    for ev in calendar_list.list_events(
+        service, TRAVEL_CAL_ID, fields=PREVIEW_FIELDS, privateExtendedProperty=f"flight_preview={tag}"
+    ):
+        same = wanted.get(_preview_signature(ev))
+        if same:
+            same.pop()
+        else:
+            requests.append(service.events().delete(calendarId=TRAVEL_CAL_ID, eventId=ev["id"]))
+    requests += [service.events().insert(calendarId=TRAVEL_CAL_ID, body=body)
+                 for group in wanted.values() for body in group]
+    if not requests:
+        return
+
+    failures = []
+
+    def done(request_id, response, exception):
+        if exception is not None and exception.resp.status not in (404, 410):  # already gone is fine
+            failures.append(exception)
+
+    batch = service.new_batch_http_request()
+    for i, request in enumerate(requests):
+        batch.add(request, callback=done, request_id=str(i))
+    metrics.inc("calendar_calls", op="batch")
+    batch.execute()
+    if failures:
+        raise failures[0]  # the calendar writer retries; the next sync re-diffs
+
+def preview_key(flight):
+    # The summary shows the price, so a refreshed fare is a different preview.
+    return f"{flight['key']}${flight['price']}"
+
+def queue_preview(flights, idx, tag, color):
+    """Hand the selected preview to the background writer; pre-build idx ± 1."""
+    n = len(flights)
+    for i in (idx, (idx - 1) % n, (idx + 1) % n):
+        f = flights[i]
+        bodies = calendar_writer.prepared(tag, preview_key(f), lambda f=f: preview_bodies(f, tag, color))
+        if i == idx:
+            calendar_writer.show_preview(tag, preview_key(f), bodies)
+
+# -----------------------------------------------------
+# TRIP BLOCK
+# -----------------------------------------------------
+def current_trip():
+    first, last = (ROUTE_DATES[0], ROUTE_DATES[-1]) if MULTI_CITY else (DEPART_DATE, RETURN_DATE)
+    end = (datetime.strptime(last, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+    return {"id": TRIP_ID, "name": TRIP_NAME, "start": first, "end": end}
+
+def create_trip_block(service):
+    trip_registry.sync_trip_blocks(service, TRAVEL_CAL_ID, [current_trip()])
+
+# -----------------------------------------------------
+# EXPORT
+# -----------------------------------------------------
+def add_to_plan(legs):
+    """Keep this trip's chosen itineraries [(label, flight)] for export with the other trips."""
+    return trip_export.select(current_trip(), legs)
+
+def queue_plan_import(plan):
+    """Put every planned flight in the travel calendar: one batched import, in the background."""
+    calendar_writer.enqueue("trip_plan", "import_plan", {"plan": plan})
+
+def start_calendar_writer():
+    calendar_writer.register("sync_preview", lambda svc, p: sync_preview(svc, p["tag"], p["bodies"]))
+    calendar_writer.register("create_trip_block", lambda svc, p: create_trip_block(svc))
+    calendar_writer.register("apply_edit", apply_edit)
+    calendar_writer.register("import_plan", lambda svc, p: trip_export.import_events(svc, TRAVEL_CAL_ID, p["plan"], TZ))
+    calendar_writer.start(get_calendar_service)
+
+# -----------------------------------------------------
+# SESSION STATE
+# -----------------------------------------------------
+def load_flights():
+    """This trip's itineraries ((outbound, inbound), or the multi-city legs) + when each was fetched."""
+    if MULTI_CITY:
+        return load_multi_city()
+    outbound, inbound, fetched_at = load_round_trip() if ROUND_TRIP else load_trip()
+    return (outbound, inbound), fetched_at
+
+def store_flights(state, flights, fetched_at):
+    """Put freshly loaded itineraries in the shared store and point the session at them.
+
+    The handle names the cache entries they came from, so sessions that
+    loaded the same fares share one copy.
+    """
+    state["flights"] = STORE.put((TRIP_MODE, tuple(sorted(fetched_at.items()))), flights)
+    state["fetched_at"] = fetched_at
+
+def session_flights(state):
+    """The session's itineraries; rebuilt from the flight cache if they were evicted."""
+    return STORE.get(state["flights"], lambda: load_flights()[0])
+
+def new_state():
+    """Handles to both legs (cached, fetched on a miss) for a new session; queues the trip block."""
+    if MULTI_CITY:
+        state = {"idx": 0}
+    else:
+        # Old trip files hold single-airport searches.
+        flight_cache.import_trip_file(JSON_FILE, (ORIGIN, DEST, DEPART_DATE), (DEST, ORIGIN, RETURN_DATE))
+        state = {"idx_out": 0, "idx_in": 0}
+    store_flights(state, *load_flights())
+    calendar_writer.enqueue("trip_block", "create_trip_block", {})
+    return state
+
+def trip_days(state):
+    """Dates whose calendar activities constrain the legs (outbound, inbound or each route leg)."""
+    if MULTI_CITY:
+        return tuple(datetime.strptime(d, "%Y-%m-%d").date() for d in ROUTE_DATES)
+    all_out, all_in = session_flights(state)
+    out_date = parse_dt(all_out[0]["segments"][-1]["arr_time"]).date()
+    if ROUND_TRIP:
+        in_date = datetime.strptime(RETURN_DATE, "%Y-%m-%d").date()
+    else:
+        in_date = parse_dt(all_in[0]["segments"][0]["dep_time"]).date()
+    return out_date, in_date
+
+def plan_options(service, state, rules, weights, reloaded=False, waiting=nullcontext, overlay=None):
+    """Filter and rank both legs against the calendar (plus any what-if overlay).
+
+    Returns (valid_out, pareto_out, valid_in, pareto_in) and keeps state's
+    selection indexes in range (and on the same flight when results reload).
+    waiting() wraps the one call that can block: the selected outbound's returns.
+    """
+    out_date, in_date = trip_days(state)
+    all_out, all_in = session_flights(state)
+    with metrics.timed("get_day_constraints_out"):
+        out_earliest_start, _ = get_day_constraints(service, out_date, overlay)
+    with metrics.timed("get_day_constraints_in"):
+        _, in_latest_end = get_day_constraints(service, in_date, overlay)
+
+    with metrics.timed("filter"):
+        valid_out = filter_arrival_flights(all_out, out_earliest_start, rules)
+    with metrics.timed("rank"):
+        valid_out, pareto_out = rank_flights(valid_out, out_earliest_start, weights, arrival=True)
+
+    # New results merged in: keep showing the flight the user was looking at.
+    if reloaded:
+        state["idx_out"] = index_of_key(valid_out, state.get("key_out"), state["idx_out"])
+    state["idx_out"] %= max(1, len(valid_out))
+
+    if ROUND_TRIP:
+        with metrics.timed("return_options"), waiting():
+            all_in = round_trip_returns(valid_out, state["idx_out"])
+        selected = valid_out[state["idx_out"]]["key"] if valid_out else None
+        reloaded = reloaded or state.get("returns_for") != selected
+        state["returns_for"] = selected
+
+    with metrics.timed("filter"):
+        valid_in = filter_departure_flights(all_in, in_latest_end, rules)
+    with metrics.timed("rank"):
+        valid_in, pareto_in = rank_flights(valid_in, in_latest_end, weights, arrival=False)
+
+    if reloaded:
+        state["idx_in"] = index_of_key(valid_in, state.get("key_in"), state["idx_in"])
+    state["idx_in"] %= max(1, len(valid_in))
+
+    return valid_out, pareto_out, valid_in, pareto_in
@@ -0,0 +1,149 @@
+# ============================================
+# Filename: price_watch.py
+# Purpose: Background re-fetch of watched routes + price history
+# Snapshots are appended to a JSONL time series; drops are flagged per flight
+# ============================================
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+import flight_cache
+import metrics
+
+HISTORY_FILE = "price_history.jsonl"
+TICK_SECONDS = 60
+
+# (days until departure, refresh interval in seconds), first match wins
+REFRESH_SCHEDULE = [
+    (2, 1 * 3600),
+    (7, 3 * 3600),
+    (21, 6 * 3600),
+    (60, 12 * 3600),
+    (None, 24 * 3600),
+]
+
+_lock = threading.Lock()
+_watched = {}   # route key -> (origin, dest, date)
+_history = {}   # route key -> list of snapshots, oldest first
+_loaded = False
+_torn = False   # the file ends mid-line (a crash during an append)
+_thread = None
+
+
+def refresh_interval(date, now=None):
+    """Seconds between refreshes for a departure date; None once it has passed."""
+    now = now or datetime.now()
+    days = (datetime.strptime(date, "%Y-%m-%d") - now).total_seconds() / 86400
+    if days < -1:
+        return None
+    for limit, interval in REFRESH_SCHEDULE:
+        if limit is None or days <= limit:
+            return interval
+
+
+# -----------------------------------------------------
+# TIME SERIES
+# -----------------------------------------------------
+def _load_history():
+    global _loaded, _torn
+    if _loaded:
+        return
+    _loaded = True
+    if not os.path.exists(HISTORY_FILE):
+        return
+    with open(HISTORY_FILE) as f:
+        for line in f:
+            _torn = not line.endswith("\n")
+            if not line.strip():
+                continue
+            try:
+                snap = json.loads(line)
+                series = _history.setdefault(snap["r"], [])
+            except (ValueError, KeyError, TypeError):
+                # e.g. a line cut short by a crash mid-append; the rest is still good
+                metrics.inc("price_history_corrupt")
+                continue
+            series.append(snap)
+
+
+def observe(route, fetched_at, flights):
+    """Record a snapshot for a fetched payload (once per fetch)."""
+    global _torn
+    with _lock:
+        _load_history()
+        series = _history.setdefault(route, [])
+        if series and series[-1]["t"] >= int(fetched_at):
+            return
+        snap = {
+            "t": int(fetched_at),
+            "r": route,
+            "p": {f["key"]: f["price"] for f in flights if f["price"] is not None},
+        }
+        series.append(snap)
+        with open(HISTORY_FILE, "a") as f:
+            # Start on a fresh line rather than extending a torn one.
+            f.write(("\n" if _torn else "") + json.dumps(snap, separators=(",", ":")) + "\n")
+        _torn = False
+
+
+def history(route):
+    with _lock:
+        _load_history()
+        return list(_history.get(route, []))
+
+
+def price_change(route, flight):
+    """(first seen price, latest price) for a flight on a route, or None if unseen."""
+    key = flight["key"]
+    prices = [s["p"][key] for s in history(route) if key in s["p"]]
+    if not prices:
+        return None
+    return prices[0], prices[-1]
+
+
+# -----------------------------------------------------
+# SCHEDULER
+# -----------------------------------------------------
+def watch(origin, dest, date):
+    with _lock:
+        _watched[flight_cache.route_key(origin, dest, date)] = (origin, dest, date)
+
+
+def refresh_due(fetch, parse):
+    """Re-fetch every watched route whose cache entry is older than its interval."""
+    with _lock:
+        routes = list(_watched.items())
+
+    for key, (origin, dest, date) in routes:
+        interval = refresh_interval(date)
+        if interval is None:
+            continue
+        # Going through the cache keeps this to one SerpAPI call per route per interval.
+        entry = flight_cache.get_route(origin, dest, date, fetch, max_age=interval)
+        series = history(key)
+        if not series or series[-1]["t"] < int(entry["fetched_at"]):
+            observe(key, entry["fetched_at"], parse(entry["raw"]))
+        metrics.set_gauge("price_watch_age_seconds", int(time.time() - entry["fetched_at"]), route=key)
+
+
+def start(fetch, parse, tick=TICK_SECONDS):
+    """Start the refresh loop once per process; later calls are no-ops."""
+    global _thread
+    with _lock:
+        if _thread is not None:
+            return
+
+        def loop():
+            while True:
+                try:
+                    refresh_due(fetch, parse)
+                except Exception as e:
+                    metrics.inc("price_watch_errors")
+                    print("price_watch refresh failed:", e)
+                time.sleep(tick)
+
+        _thread = threading.Thread(target=loop, name="price-watch", daemon=True)
+        _thread.start()
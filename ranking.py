@@ -0,0 +1,92 @@
+# ============================================
+# Filename: ranking.py
+# Purpose: Multi-objective ranking of itineraries
+# Pareto-optimal options first, then everything else, each ordered by a
+# weighted score. All objectives are minimised (slack is negated).
+# ============================================
+
+import numpy as np
+
+OBJECTIVES = ("price", "duration", "stops", "carbon", "slack")
+
+PRESETS = {
+    "balanced": {"price": 1.0, "duration": 0.5, "stops": 0.3, "carbon": 0.1, "slack": 0.2},
+    "price": {"price": 1.0},
+    "duration": {"duration": 1.0},
+    "stops": {"stops": 1.0, "duration": 0.1},
+    "carbon": {"carbon": 1.0},
+    "slack": {"slack": 1.0},
+}
+
+BLOCK = 256
+
+
+def objective_matrix(flights, slack_minutes=None):
+    """(n, 5) float matrix; missing values become the column's worst value."""
+    n = len(flights)
+    m = np.empty((n, len(OBJECTIVES)), dtype=float)
+    m[:, 0] = [f.price if f.price is not None else np.nan for f in flights]
+    m[:, 1] = [f.total_duration if f.total_duration is not None else np.nan for f in flights]
+    m[:, 2] = [f.stops for f in flights]
+    m[:, 3] = [f.carbon if f.carbon is not None else np.nan for f in flights]
+    m[:, 4] = -np.asarray(slack_minutes, dtype=float) if slack_minutes is not None else 0.0
+
+    worst = np.nanmax(np.where(np.isnan(m), -np.inf, m), axis=0) if n else np.zeros(len(OBJECTIVES))
+    worst = np.where(np.isfinite(worst), worst, 0.0)
+    return np.where(np.isnan(m), worst, m)
+
+
+def _dominated(points, cands):
+    """For each candidate row, is some row of points at least as good everywhere and better somewhere?"""
+    le = (points[None, :, :] <= cands[:, None, :]).all(axis=2)
+    out = np.zeros(len(cands), dtype=bool)
+    hit = np.flatnonzero(le.any(axis=1))
+    if len(hit):
+        lt = (points[None, :, :] < cands[hit, None, :]).any(axis=2)
+        out[hit] = (le[hit] & lt).any(axis=1)
+    return out
+
+
+def pareto_mask(m):
+    """Boolean mask of non-dominated rows.
+
+    Rows are visited in order of their objective sum, so anything that dominates a
+    row comes before it; each block is checked against the front found so far and
+    against itself, which keeps the work near O(n * |front|).
+    """
+    n = len(m)
+    mask = np.zeros(n, dtype=bool)
+    if n == 0:
+        return mask
+
+    order = np.argsort(m.sum(axis=1), kind="stable")
+    front = np.empty((0, m.shape[1]))
+    for start in range(0, n, BLOCK):
+        idx = order[start:start + BLOCK]
+        if len(front):
+            idx = idx[~_dominated(front, m[idx])]
+        block = m[idx]
+        idx = idx[~_dominated(block, block)]
+
+        mask[idx] = True
+        front = np.vstack([front, m[idx]])
+    return mask
+
+
+def weighted_scores(m, weights):
+    lo, hi = m.min(axis=0), m.max(axis=0)
+    span = np.where(hi > lo, hi - lo, 1.0)
+    w = np.array([weights.get(name, 0.0) for name in OBJECTIVES])
+    return ((m - lo) / span) @ w
+
+
+def rank(flights, slack_minutes=None, weights=None):
+    """Return (flights reordered, parallel list of is-Pareto flags)."""
+    if not flights:
+        return [], []
+    m = objective_matrix(flights, slack_minutes)
+    scores = weighted_scores(m, weights or PRESETS["balanced"])
+    front = pareto_mask(m)
+    # Pareto front first, then by score; lexsort's last key is the primary one.
+    order = np.lexsort((scores, ~front))
+    return [flights[i] for i in order], [bool(front[i]) for i in order]
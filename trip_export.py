@@ -0,0 +1,212 @@
+# ============================================
+# Filename: trip_export.py
+# Purpose: The chosen itineraries of every planned trip, ready to book
+# Selections are kept in trip_plan.json (one entry per trip, whichever run of
+# the planner picked it) and leave in one go: as a single .ics file, as JSON
+# or as one batched Calendar import. Each flight carries its booking_token and
+# a Google Flights search link for its route and day.
+# ============================================
+
+import hashlib
+import json
+import os
+from datetime import datetime
+from urllib.parse import quote
+
+import pytz
+
+import calendar_list
+import metrics
+
+PLAN_FILE = "trip_plan.json"
+BATCH_LIMIT = 1000  # requests per Calendar batch
+ICS_PRODID = "-//flight-planner//trip export//EN"
+
+
+# -----------------------------------------------------
+# PLAN FILE
+# -----------------------------------------------------
+def load_plan():
+    if not os.path.exists(PLAN_FILE):
+        return {}
+    with open(PLAN_FILE) as f:
+        return json.load(f)
+
+
+def save_plan(plan):
+    tmp = PLAN_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(plan, f, indent=2)
+    os.replace(tmp, PLAN_FILE)
+
+
+def flights_link(flight):
+    """Google Flights search for this itinerary's route and day.
+
+    A free-text search, not a link to the fare itself: the booking_token is
+    what identifies the chosen itinerary.
+    """
+    first, last = flight["segments"][0], flight["segments"][-1]
+    query = f"Flights from {first['dep']} to {last['arr']} on {first['dep_time'][:10]} one way"
+    return f"https://www.google.com/travel/flights?q={quote(query)}"
+
+
+def leg_record(label, flight):
+    """Plain-data copy of one chosen itinerary; the plan file outlives the parsed records."""
+    return {
+        "label": label,
+        "key": flight["key"],
+        "price": flight["price"],
+        "total_duration": flight["total_duration"],
+        "booking_token": flight.get("booking_token"),
+        "departure_token": flight.get("departure_token"),
+        "link": flights_link(flight),
+        "segments": [
+            {
+                "dep": s["dep"],
+                "arr": s["arr"],
+                "dep_time": s["dep_time"],
+                "arr_time": s["arr_time"],
+                "airline": s["airline"],
+                "flight_number": s["flight_number"],
+            }
+            for s in flight["segments"]
+        ],
+    }
+
+
+def select(trip, legs):
+    """Record the chosen itineraries for a trip, replacing any earlier choice.
+
+    trip = {"id", "name", "start", "end"} as in trip_registry; legs = [(label, flight)].
+    """
+    plan = load_plan()
+    plan[trip["id"]] = {**trip, "legs": [leg_record(label, f) for label, f in legs]}
+    save_plan(plan)
+    return plan
+
+
+def remove(trip_id):
+    plan = load_plan()
+    plan.pop(trip_id, None)
+    save_plan(plan)
+    return plan
+
+
+# -----------------------------------------------------
+# EVENTS
+# -----------------------------------------------------
+def event_bodies(plan, tz):
+    """One Calendar event per flight segment of every trip in the plan.
+
+    iCalUID is derived from trip, itinerary and segment, so importing the same
+    plan twice updates the events instead of duplicating them.
+    """
+    bodies = []
+    for trip_id, trip in sorted(plan.items(), key=lambda item: item[1]["start"]):
+        for leg in trip["legs"]:
+            for i, s in enumerate(leg["segments"]):
+                uid = hashlib.sha1(f"{trip_id}|{leg['key']}|{i}".encode()).hexdigest()
+                lines = [
+                    f"{trip['name']} · {leg['label']} · ${leg['price']}",
+                    f"{s['airline']} {s['flight_number'] or ''}".strip(),
+                    f"Search: {leg['link']}",
+                ]
+                if leg["booking_token"]:
+                    lines.append(f"Booking token: {leg['booking_token']}")
+                bodies.append({
+                    "iCalUID": f"{uid}@flight-planner",
+                    "summary": f"✈️ {s['dep']} → {s['arr']} ({s['flight_number'] or s['airline']})",
+                    "description": "\n".join(lines),
+                    "start": {"dateTime": tz.localize(datetime.strptime(s["dep_time"], "%Y-%m-%d %H:%M")).isoformat()},
+                    "end": {"dateTime": tz.localize(datetime.strptime(s["arr_time"], "%Y-%m-%d %H:%M")).isoformat()},
+                    "source": {"title": "Google Flights", "url": leg["link"]},
+                    "extendedProperties": {"private": {
+                        "booked_flight": "yes", "trip_id": trip_id, "itinerary": leg["key"],
+                    }},
+                })
+    return bodies
+
+
+def import_events(service, calendar_id, plan, tz):
+    """Write the whole plan to the calendar in one batch (per BATCH_LIMIT requests).
+
+    Flights imported earlier for these trips that are no longer chosen are
+    deleted in the same batch, so picking another itinerary replaces the old
+    one. Returns the number of events written; raises the first failure after
+    the batch so the calendar writer can retry it (the import is idempotent).
+    """
+    bodies = event_bodies(plan, tz)
+    uids = {body["iCalUID"] for body in bodies}
+    stale = [
+        ev["id"]
+        for ev in calendar_list.list_events(service, calendar_id, fields="id,iCalUID,extendedProperties/private",
+                                            privateExtendedProperty="booked_flight=yes")
+        if ev["extendedProperties"]["private"].get("trip_id") in plan and ev.get("iCalUID") not in uids
+    ]
+    requests = [service.events().delete(calendarId=calendar_id, eventId=event_id) for event_id in stale]
+    requests += [service.events().import_(calendarId=calendar_id, body=body) for body in bodies]
+    failures = []
+
+    def done(request_id, response, exception):
+        if exception is not None and exception.resp.status not in (404, 410):  # already gone is fine
+            failures.append(exception)
+
+    for start in range(0, len(requests), BATCH_LIMIT):
+        batch = service.new_batch_http_request()
+        for i, request in enumerate(requests[start:start + BATCH_LIMIT]):
+            batch.add(request, callback=done, request_id=str(start + i))
+        metrics.inc("calendar_calls", op="batch")
+        batch.execute()
+
+    if failures:
+        raise failures[0]
+    return len(bodies)
+
+
+# -----------------------------------------------------
+# FILE EXPORTS
+# -----------------------------------------------------
+def to_json(plan):
+    return json.dumps({"trips": [plan[k] for k in sorted(plan, key=lambda k: plan[k]["start"])]}, indent=2)
+
+
+def _ics_text(value):
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _ics_fold(line):
+    """Split a content line into 75-octet pieces (RFC 5545 §3.1) without breaking UTF-8."""
+    out, current = [], ""
+    for ch in line:
+        limit = 75 if not out else 74  # continuation lines start with a space
+        if len((current + ch).encode()) > limit:
+            out.append(current)
+            current = ""
+        current += ch
+    out.append(current)
+    return "\r\n ".join(out)
+
+
+def _ics_time(value):
+    return datetime.fromisoformat(value["dateTime"]).astimezone(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def to_ics(plan, tz):
+    """The whole plan as one iCalendar file, for any calendar app."""
+    stamp = datetime.now(pytz.utc).strftime("%Y%m%dT%H%M%SZ")
+    lines = ["BEGIN:VCALENDAR", "VERSION:2.0", f"PRODID:{ICS_PRODID}", "CALSCALE:GREGORIAN"]
+    for body in event_bodies(plan, tz):
+        lines += [
+            "BEGIN:VEVENT",
+            f"UID:{body['iCalUID']}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{_ics_time(body['start'])}",
+            f"DTEND:{_ics_time(body['end'])}",
+            f"SUMMARY:{_ics_text(body['summary'])}",
+            f"DESCRIPTION:{_ics_text(body['description'])}",
+            f"URL:{body['source']['url']}",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "\r\n".join(_ics_fold(line) for line in lines) + "\r\n"
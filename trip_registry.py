@@ -0,0 +1,126 @@
+# ============================================
+# Filename: trip_registry.py
+# Purpose: Local record of which calendar event is each trip's all-day block
+# Known blocks are checked with one batched events().get instead of a list,
+# and any number of trips are created / updated / moved in one batch
+# ============================================
+
+import json
+import os
+
+import calendar_list
+import metrics
+
+REGISTRY_FILE = "trip_registry.json"
+# What _differs and the adoption check read
+BLOCK_FIELDS = "id,summary,start,end,extendedProperties/private"
+
+
+def load():
+    if not os.path.exists(REGISTRY_FILE):
+        return {}
+    with open(REGISTRY_FILE) as f:
+        return json.load(f)
+
+
+def save(registry):
+    tmp = REGISTRY_FILE + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp, REGISTRY_FILE)
+
+
+def trip_body(trip):
+    """trip = {"id", "name", "start", "end"}; dates are YYYY-MM-DD, end exclusive."""
+    return {
+        "summary": trip["name"],
+        "start": {"date": trip["start"]},
+        "end": {"date": trip["end"]},
+        "colorId": "5",
+        "extendedProperties": {"private": {"trip_block": "yes", "trip_id": trip["id"]}},
+    }
+
+
+def _differs(event, body):
+    return any(event.get(k) != body[k] for k in ("summary", "start", "end"))
+
+
+def _find_unregistered(service, calendar_id, trip):
+    """Block for a trip missing from the registry (new machine, or made by an older version)."""
+    found = next(calendar_list.list_events(
+        service, calendar_id, fields=BLOCK_FIELDS, privateExtendedProperty=f"trip_id={trip['id']}"
+    ), None)
+    if found is not None:
+        return found
+
+    # Older versions tagged blocks only with trip_block=yes; adopt one with our name.
+    for ev in calendar_list.list_events(
+        service, calendar_id, fields=BLOCK_FIELDS, privateExtendedProperty="trip_block=yes"
+    ):
+        if ev.get("summary") == trip["name"] and "trip_id" not in ev["extendedProperties"]["private"]:
+            return ev
+    return None
+
+
+def sync_trip_blocks(service, calendar_id, trips):
+    """Make sure every trip has exactly one up-to-date block. Returns {trip id: event id}."""
+    registry = load()
+    current = {}
+    failures = []
+
+    # 1. One batch of cheap gets for every trip we already know about.
+    known = [t for t in trips if t["id"] in registry]
+    if known:
+        def got(request_id, response, exception):
+            if exception is None:
+                if response.get("status") != "cancelled":
+                    current[known[int(request_id)]["id"]] = response
+            elif exception.resp.status not in (404, 410):  # gone = recreate below
+                failures.append(exception)
+
+        batch = service.new_batch_http_request()
+        for i, trip in enumerate(known):
+            batch.add(service.events().get(calendarId=calendar_id, eventId=registry[trip["id"]],
+                                           fields="status," + BLOCK_FIELDS),
+                      callback=got, request_id=str(i))
+        metrics.inc("calendar_calls", op="batch")
+        batch.execute()
+        if failures:
+            raise failures[0]
+
+    for trip in trips:
+        if trip["id"] not in registry:
+            found = _find_unregistered(service, calendar_id, trip)
+            if found is not None:
+                current[trip["id"]] = found
+
+    # 2. One batch of inserts / patches for whatever is missing or has moved.
+    writes = []
+    for trip in trips:
+        body = trip_body(trip)
+        ev = current.get(trip["id"])
+        if ev is None:
+            writes.append((trip, service.events().insert(calendarId=calendar_id, body=body)))
+        elif _differs(ev, body) or ev.get("extendedProperties", {}).get("private", {}).get("trip_id") != trip["id"]:
+            writes.append((trip, service.events().patch(calendarId=calendar_id, eventId=ev["id"], body=body)))
+        else:
+            registry[trip["id"]] = ev["id"]
+
+    if writes:
+        def wrote(request_id, response, exception):
+            trip = writes[int(request_id)][0]
+            if exception is not None:
+                failures.append(exception)
+                return
+            registry[trip["id"]] = response["id"]
+
+        batch = service.new_batch_http_request()
+        for i, (_, request) in enumerate(writes):
+            batch.add(request, callback=wrote, request_id=str(i))
+        metrics.inc("calendar_calls", op="batch")
+        batch.execute()
+
+    save(registry)
+    if failures:
+        raise failures[0]  # lets the calendar writer retry the rest
+    return {t["id"]: registry.get(t["id"]) for t in trips}